@@ -1,44 +1,26 @@
 #!/usr/bin/python
 import time
-import yaml
 import os
 from datetime import datetime
-from picamera2 import Picamera2
 import shutil
-import libcamera
-import subprocess
 import logging
-from overlay import add_overlay  # import add_overlay function from overlay.py
-import json 
-
-# Load configuration from yaml file
-def load_config(config_path):
-    with open(config_path, 'r') as config_file:
-        return yaml.safe_load(config_file)
-
+from overlay import add_overlay, render_overlay, overlay_sidecar, record_overlay  # import overlay functions from overlay.py
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+from scripts.v4l2 import get_control, set_control, V4L2_CID_WIDE_DYNAMIC_RANGE
+from scripts.camera_state import get_camera_state
+from scripts.camera_backend import open_camera, get_controls
+from scripts.stage_timer import timed
+from scripts.config import load_config
+from scripts.staging import get_staging_area, commit_frame, flush_staging
 
 DAYTIME_SHUTTER = 4489
 DAYTIME_GAIN = 1
 
-def reset_to_daytime_settings():
-    """Reset the camera settings to daytime values if they are not already."""
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    camera_state_file = os.path.join(script_dir, 'data', 'camera_state.json')
-
-    # Load existing state
-    try:
-        with open(camera_state_file, "r") as file:
-            state = json.load(file)
-    except FileNotFoundError:
-        state = {}
-
-    # Update only shutter_speed and gain to daytime values
-    state["shutter_speed"] = DAYTIME_SHUTTER
-    state["gain"] = DAYTIME_GAIN
-
-    # Save the updated state
-    with open(camera_state_file, "w") as file:
-        json.dump(state, file)
+def reset_to_daytime_settings(camera_num=0):
+    """Reset the camera state to daytime values if they are not already."""
+    # The night auto exposure starts from the plan again
+    get_camera_state(camera_num).update(shutter_speed=DAYTIME_SHUTTER, gain=DAYTIME_GAIN, ev_offset=0.0)
 
 # Set up logging
 def setup_logging(config):
@@ -51,35 +33,234 @@ def setup_logging(config):
     else:
         return False
 
+def set_hdr(enabled, device='/dev/v4l-subdev0'):
+    """
+    Enable or disable HDR (wide dynamic range) on the sensor. Only works with v3 cameras.
+
+    The control is read first and only written when it differs, both through ioctl calls
+    instead of running v4l2-ctl for every frame.
+    :return: True if the sensor setting was changed.
+    """
+    try:
+        if get_control(device, V4L2_CID_WIDE_DYNAMIC_RANGE) == int(enabled):
+            return False
+        set_control(device, V4L2_CID_WIDE_DYNAMIC_RANGE, int(enabled))
+        print(f"Set wide_dynamic_range={int(enabled)} on {device}")
+        return True
+    except OSError as e:
+        print(f"Failed to set HDR on {device}: {e}")
+        return False
+
+def build_day_controls(config):
+    """Build the camera controls used for daytime captures."""
+    controls = get_controls()
+    # Set focus mode and lens position based on config
+    focus_mode = controls.AfModeEnum.Manual if config['focus_mode'] == 'manual' else controls.AfModeEnum.Auto
+    lens_position = config['lens_position'] if config['focus_mode'] == 'manual' else None
+
+    return {
+        "AwbEnable": config['awb_enable'],
+        "AwbMode": getattr(controls.AwbModeEnum, config['awb_mode']),
+        "AfMode": focus_mode,
+        "LensPosition": lens_position,
+        "ColourGains": tuple(config['colour_gains']),
+        "AnalogueGain": 1
+    }
+
+def create_camera_config(camera, config, controls):
+    """Create the still configuration for the given controls."""
+    return camera.create_still_configuration(
+        main={"size": tuple(config['main_size'])},
+        lores={"size": tuple(config['lores_size'])},
+        display=config['display'],
+        controls=controls
+    )
+
+def values_close(actual, target, tolerance):
+    """Compare a reported control value (or tuple of values) with the requested one."""
+    if isinstance(target, (tuple, list)):
+        return len(actual) == len(target) and all(values_close(a, t, tolerance) for a, t in zip(actual, target))
+    return abs(actual - target) <= tolerance * max(abs(target), 1.0)
+
+def metadata_converged(metadata, targets, tolerance):
+    """Check if the frame metadata shows the requested controls applied and AE/AF at rest."""
+    for key, target in targets.items():
+        if key not in metadata or not values_close(metadata[key], target, tolerance):
+            return False
+    # Automatic exposure must have locked, automatic focus must not be scanning
+    if 'ExposureTime' not in targets and metadata.get('AeLocked') is False:
+        return False
+    if metadata.get('AfState') == get_controls().AfStateEnum.Scanning:
+        return False
+    return True
+
+def wait_for_settle(camera, controls, config, logging_enabled=False):
+    """
+    Wait until the per-frame metadata shows that the camera has applied the requested controls.
+
+    Replaces a fixed sleep after starting the camera. With manual exposure and focus this returns
+    after a few frames, values the sensor cannot reach (e.g. gain above its maximum) are accepted
+    once they stop changing, and settle.timeout bounds the wait.
+    :return: True if the controls converged, False on timeout.
+    """
+    settle = config.get('settle', {})
+    timeout = settle.get('timeout', 2.0)
+    tolerance = settle.get('tolerance', 0.05)
+
+    targets = {key: controls[key] for key in ('ExposureTime', 'AnalogueGain', 'LensPosition') if controls.get(key) is not None}
+    if controls.get('AwbEnable') is False and controls.get('ColourGains') is not None:
+        targets['ColourGains'] = tuple(controls['ColourGains'])
+
+    start = time.monotonic()
+    previous = None
+    stable_frames = 0
+    frames = 0
+    while True:
+        metadata = camera.capture_metadata()
+        frames += 1
+        if metadata_converged(metadata, targets, tolerance):
+            break
+
+        current = tuple(metadata.get(key) for key in ('ExposureTime', 'AnalogueGain', 'LensPosition'))
+        stable_frames = stable_frames + 1 if current == previous else 0
+        previous = current
+        if stable_frames >= 3:
+            break
+
+        if time.monotonic() - start >= timeout:
+            print(f"Camera did not settle within {timeout}s after {frames} frames")
+            if logging_enabled:
+                logging.warning(f"Camera did not settle within {timeout}s after {frames} frames: {metadata}")
+            return False
+
+    print(f"Camera settled after {frames} frames in {time.monotonic() - start:.2f}s")
+    return True
+
+def get_image_path(config, now=None):
+    """
+    Return the path of the next image, creating its folder if needed.
+
+    With staging enabled this is the path in the staging area the frame is finished in.
+    """
+    now = now or datetime.now()
+    dir_name = os.path.join(config['image_output']['root_folder'], now.strftime(config['image_output']['folder_structure']))
+    file_name = os.path.join(dir_name, f"{config['image_output']['filename_prefix']}{now.strftime('%Y_%m_%d_%H_%M_%S')}.jpg")
+    staging_area = get_staging_area(config)
+    if staging_area is not None:
+        return staging_area.work_path(file_name)
+    os.makedirs(dir_name, exist_ok=True)
+    return file_name
+
+def build_exif(camera, metadata, now=None):
+    """Build EXIF data for an in-memory capture from the request metadata."""
+    now = now or datetime.now()
+    exif = Image.Exif()
+    exif[0x010F] = "Raspberry Pi"  # Make
+    exif[0x0110] = camera.camera_properties.get('Model', '')  # Model
+    exif[0x0132] = now.strftime('%Y:%m:%d %H:%M:%S')  # DateTime
+
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x9003] = now.strftime('%Y:%m:%d %H:%M:%S')  # DateTimeOriginal
+    if 'ExposureTime' in metadata:
+        exif_ifd[0x829A] = IFDRational(metadata['ExposureTime'], 1000000)  # ExposureTime in seconds
+    if 'AnalogueGain' in metadata:
+        gain = metadata['AnalogueGain'] * metadata.get('DigitalGain', 1.0)
+        exif_ifd[0x8827] = int(gain * 100)  # ISOSpeedRatings
+    if metadata.get('StackDepth', 1) > 1:
+        exif[0x010E] = f"Stack of {metadata['StackDepth']} frames"  # ImageDescription
+    return exif
+
+def capture_in_memory(camera):
+    """Capture the main stream into a PIL image and return it with its request metadata."""
+    with timed('capture'):
+        request = camera.capture_request()
+        try:
+            img = request.make_image('main')
+            metadata = request.get_metadata()
+        finally:
+            # Hand the buffer back to the camera before the slow image work
+            request.release()
+    return img, metadata
+
+def save_frame(config, img, exif, file_name, overlay=True, captured_values=None):
+    """
+    Crop and overlay an in-memory frame and encode it to file_name.
+
+    :param captured_values: Overlay values taken when the frame was captured, see overlay.collect_capture_values.
+    """
+    if overlay and config['overlay']['enabled'] and not overlay_sidecar(config):
+        with timed('overlay'):
+            img = render_overlay(config, img, values=record_overlay(config, file_name, captured_values))
+    with timed('encode'):
+        img.save(file_name, quality=config['image_quality'], exif=exif)
+
+def capture_to_file(camera, config, file_name, overlay=True):
+    """
+    Capture an image to file_name.
+
+    With in_memory_pipeline enabled the frame is captured into memory, cropped and overlaid
+    there and JPEG-encoded exactly once, instead of being encoded by capture_file and then
+    decoded and re-encoded by the overlay.
+    :return: Tuple of (overlay already drawn, frame metadata).
+    """
+    if not config.get('in_memory_pipeline', False):
+        with timed('capture'):
+            metadata = camera.capture_file(file_name)
+        return False, metadata
+
+    img, metadata = capture_in_memory(camera)
+    save_frame(config, img, build_exif(camera, metadata), file_name, overlay)
+    return True, metadata
+
+def apply_overlay(config, file_name, overlay_added=False, captured_values=None):
+    """
+    Draw the overlay on a stored frame, or record its values next to it in sidecar mode.
+
+    :param captured_values: Overlay values taken when the frame was captured, see overlay.collect_capture_values.
+    :return: The recorded overlay values in sidecar mode, otherwise None.
+    """
+    if not config['overlay']['enabled']:
+        return None
+    # Only time what is done here, a band drawn in memory was timed by save_frame
+    if overlay_sidecar(config):
+        with timed('overlay'):
+            return record_overlay(config, file_name, captured_values)
+    if not overlay_added:
+        with timed('overlay'):
+            add_overlay(config, file_name, values=record_overlay(config, file_name, captured_values))
+    return None
+
+def publish_status(config, file_name, overlay_values=None):
+    """Copy a frame to the status file, drawing the recorded overlay on the copy in sidecar mode if enabled."""
+    with timed('publish'):
+        if overlay_values is not None and config['overlay'].get('status_overlay', False):
+            add_overlay(config, file_name, config['status_file'], overlay_values)
+        else:
+            shutil.copy2(file_name, config['status_file'])
+
+def finish_image(config, file_name, logging_enabled, overlay_added=False, captured_values=None):
+    """Add the overlay, log and publish a freshly captured image."""
+    overlay_values = apply_overlay(config, file_name, overlay_added, captured_values)
+
+    if logging_enabled:
+        logging.info(f"Image captured and saved to {file_name}")
+
+    if (config['status_file']):
+        publish_status(config, file_name, overlay_values)
+        print(f"Copied {file_name} to {config['status_file']}")
+
+    file_name = commit_frame(config, file_name)
+    print(f"Saved file {file_name}")
+
 def capture_image(config, logging_enabled):
     # Enable or disable HDR based on config
     # This must be done before Picamera2 is ran
-    # Only works with v3 cameras
-    if config['hdr']:
-        os.system("v4l2-ctl --set-ctrl wide_dynamic_range=1 -d /dev/v4l-subdev0")
-    else:
-        os.system("v4l2-ctl --set-ctrl wide_dynamic_range=0 -d /dev/v4l-subdev0")
-
-    with Picamera2() as camera:
-        # Set focus mode and lens position based on config
-        focus_mode = libcamera.controls.AfModeEnum.Manual if config['focus_mode'] == 'manual' else libcamera.controls.AfModeEnum.Auto
-        lens_position = config['lens_position'] if config['focus_mode'] == 'manual' else None
-
-        camera_config = camera.create_still_configuration(
-            main={"size": tuple(config['main_size'])},
-            lores={"size": tuple(config['lores_size'])},
-            display=config['display'],
-            controls={
-                "AwbEnable": config['awb_enable'],
-                "AwbMode": getattr(libcamera.controls.AwbModeEnum, config['awb_mode']),
-                "AfMode": focus_mode,
-                "LensPosition": lens_position,
-                "ColourGains": tuple(config['colour_gains']),
-                "AnalogueGain": 1
-            }
-        )
+    set_hdr(config['hdr'], config.get('hdr_device', '/dev/v4l-subdev0'))
+
+    with open_camera(config) as camera:
+        camera_config = create_camera_config(camera, config, build_day_controls(config))
         camera.options['quality'] = config['image_quality']
-        print(f"libcamera.controls {libcamera.controls}")
+        print(f"libcamera.controls {get_controls()}")
         
         camera.configure(camera_config)
         # Log out all active controls before capturing the image
@@ -87,28 +268,15 @@ def capture_image(config, logging_enabled):
             logging.info(f"Camera config: {camera_config}")
 
         camera.start()
-        time.sleep(2)  # Allow the camera to adjust
-
-        now = datetime.now()
-        dir_name = os.path.join(config['image_output']['root_folder'], now.strftime(config['image_output']['folder_structure']))
-        os.makedirs(dir_name, exist_ok=True)
-        file_name = os.path.join(dir_name, f"{config['image_output']['filename_prefix']}{now.strftime('%Y_%m_%d_%H_%M_%S')}.jpg")
-        camera.capture_file(file_name)
-
-        if config['overlay']['enabled']:
-            add_overlay(config, file_name)
+        wait_for_settle(camera, camera_config['controls'], config, logging_enabled)  # Allow the camera to adjust
 
-        if logging_enabled:
-            logging.info(f"Image captured and saved to {file_name}")
-
-        if (config['status_file']):
-            shutil.copy2(file_name, config['status_file'])            
-            print(f"Copied {file_name} to {config['status_file']}")
-        
-        print(f"Saved file {file_name}")
+        file_name = get_image_path(config)
+        overlay_added, _ = capture_to_file(camera, config, file_name)
+        finish_image(config, file_name, logging_enabled, overlay_added)
 
 if __name__ == "__main__":
-    config = load_config('/home/pi/raspberrypi-picamera-timelapse/config.yaml')
+    config = load_config()
     logging_enabled = setup_logging(config)
     reset_to_daytime_settings()
     capture_image(config, logging_enabled)
+    flush_staging(config)
@@ -0,0 +1,389 @@
+#!/usr/bin/python
+import os
+import time
+import logging
+from PIL import Image
+from capture_image import set_hdr, build_day_controls, create_camera_config, get_image_path, finish_image, reset_to_daytime_settings, capture_to_file, wait_for_settle, capture_in_memory, build_exif, save_frame
+from capture_image_night import build_night_controls, get_night_image_path, finish_night_image, print_camera_config, save_camera_state
+from scripts.scene_change import create_change_detector, lores_luma, write_skip_marker
+from scripts.auto_exposure import create_exposure_controller, image_luma
+from scripts.camera_state import get_camera_state
+from scripts.frame_queue import FrameQueue
+from scripts.burst import get_burst_folder, ThroughputMeter
+from scripts.camera_backend import open_camera
+from scripts.stage_timer import timed
+from scripts.staging import get_final_path
+from overlay import collect_capture_values
+
+class CameraService:
+    """
+    Keep one Picamera2 instance open and configured between frames.
+
+    The service remembers what is currently applied to the sensor: the HDR setting, the stream
+    configuration and the controls. The camera is only reopened when HDR changes, only
+    reconfigured when the streams change or a control has to be removed, and otherwise only
+    the controls that differ are sent with set_controls.
+    """
+
+    def __init__(self, config, logging_enabled=False, frame_queue=None):
+        self.config = config
+        self.camera_num = config.get('camera_num', 0)
+        self.logging_enabled = logging_enabled
+        self.frame_queue = frame_queue
+        self.last_metadata = {}
+        self.change_detector = create_change_detector(config)
+        self.exposure_controller = create_exposure_controller(config)
+        self.last_luma = None
+        self.camera = None
+        self.mode = None
+        self.hdr = None
+        self.stream_key = None
+        self.controls = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.frame_queue is not None:
+            self.frame_queue.close()
+        self.close()
+
+    def close(self):
+        """Stop and release the camera."""
+        if self.camera is not None:
+            self.camera.close()
+            self.camera = None
+        self.mode = None
+        self.hdr = None
+        self.stream_key = None
+        self.controls = {}
+
+    def update_config(self, config):
+        """
+        Use an edited config from the next frame on.
+
+        The camera itself is left running, apply() reopens or reconfigures it only if HDR or
+        the streams changed. The change detector and exposure controller are only rebuilt when
+        their settings changed, so they keep their history otherwise.
+        """
+        previous = self.config
+        self.config = config
+        if any(config.get(key) != previous.get(key) for key in ('change_detection', 'adaptive_interval')):
+            self.change_detector = create_change_detector(config)
+        if any(config.get(key) != previous.get(key) for key in ('auto_exposure', 'camera_constants')):
+            offset = self.exposure_controller.offset if self.exposure_controller is not None else 0.0
+            self.exposure_controller = create_exposure_controller(config, offset)
+
+    def get_stream_key(self):
+        """Return the config values that require a camera reconfiguration when changed."""
+        return (tuple(self.config['main_size']), tuple(self.config['lores_size']), self.config['display'], self.config['image_quality'])
+
+    def open(self, hdr):
+        """Open the camera with the given HDR setting."""
+        self.close()
+
+        # HDR must be set before Picamera2 is opened
+        set_hdr(hdr, self.config.get('hdr_device', '/dev/v4l-subdev0'))
+        self.camera = open_camera(self.config, self.camera_num)
+        self.hdr = hdr
+
+    def configure(self, controls):
+        """Configure and start the camera with the given controls."""
+        if self.stream_key is not None:
+            self.camera.stop()
+
+        camera_config = create_camera_config(self.camera, self.config, controls)
+        self.camera.options['quality'] = self.config['image_quality']
+        self.camera.configure(camera_config)
+
+        if self.logging_enabled:
+            logging.info(f"Camera configured: {camera_config}")
+
+        self.camera.start()
+        self.stream_key = self.get_stream_key()
+        self.controls = dict(controls)
+
+    def diff_controls(self, controls):
+        """Return the controls that differ from what is applied, and whether any have been removed."""
+        changed = {key: value for key, value in controls.items() if key not in self.controls or self.controls[key] != value}
+        removed = [key for key in self.controls if key not in controls]
+        return changed, removed
+
+    def apply(self, mode, controls, hdr):
+        """Make sure the camera runs with the given controls, changing as little as possible."""
+        if self.camera is None or hdr != self.hdr:
+            self.open(hdr)
+
+        changed, removed = self.diff_controls(controls)
+        if self.stream_key != self.get_stream_key() or removed:
+            # Controls can not be unset with set_controls, e.g. going back to automatic exposure
+            self.configure(controls)
+        elif changed:
+            self.camera.set_controls(changed)
+            self.controls = dict(controls)
+        else:
+            self.mode = mode
+            return
+
+        if self.logging_enabled and mode != self.mode:
+            logging.info(f"Camera switched to {mode} mode")
+        self.mode = mode
+        wait_for_settle(self.camera, controls, self.config, self.logging_enabled)  # Allow the camera to adjust
+
+    def capture(self, file_name, finish, overlay=True, grab=None, now=None):
+        """
+        Capture a frame to file_name and run finish(overlay_added, captured_values) once it has been written.
+
+        With a frame queue the frame is captured into memory and the overlay, encoding and
+        publishing are handed to the queue, so this returns as soon as the sensor is read out.
+        The time and exposure for the overlay are taken right after the capture, so a worker
+        that gets to the frame later still draws them for this frame. The weather and Pi stats
+        are collected by the worker.
+        grab can replace the single in-memory capture, it must return (img, metadata),
+        or None if the frame should not be stored.
+        :param now: Capture time shown in the overlay, the current time if None.
+        :return: True if a frame was stored, False if it was skipped.
+        """
+        if grab is None and (self.change_detector is not None or self.exposure_controller is not None):
+            grab = self.capture_if_changed
+
+        if self.frame_queue is None and grab is None:
+            overlay_added, self.last_metadata = capture_to_file(self.camera, self.config, file_name, overlay)
+            finish(overlay_added)
+            return True
+
+        frame = grab() if grab is not None else capture_in_memory(self.camera)
+        if frame is None:
+            score = self.change_detector.last_score
+            print(f"Scene unchanged (score {score:.4f}), skipping {file_name}")
+            if self.config.get('change_detection', {}).get('write_marker', True):
+                write_skip_marker(get_final_path(self.config, file_name), score)
+            return False
+
+        img, metadata = frame
+        self.last_metadata = metadata
+        exif = build_exif(self.camera, metadata)
+        captured_values = collect_capture_values(self.config, now) if overlay and self.config['overlay']['enabled'] else None
+        if self.frame_queue is None:
+            self.write_frame(img, exif, file_name, finish, overlay, captured_values)
+        else:
+            self.frame_queue.submit(self.write_frame, img, exif, file_name, finish, overlay, captured_values)
+        return True
+
+    def get_exposure(self):
+        """Return (shutter speed, gain, scene activity) of the last captured frame."""
+        activity = self.change_detector.last_score if self.change_detector is not None else None
+        return self.last_metadata.get('ExposureTime'), self.last_metadata.get('AnalogueGain'), activity
+
+    def capture_if_changed(self):
+        """
+        Capture a frame into memory unless the lores stream shows no change since the last kept frame.
+
+        Both streams come from the same request, so a skipped frame costs no full resolution work.
+        The lores luma is kept for exposure metering.
+        :return: (img, metadata), or None if the frame should be skipped.
+        """
+        with timed('capture'):
+            request = self.camera.capture_request()
+            try:
+                lores_height = self.camera.camera_config['lores']['size'][1]
+                self.last_luma = lores_luma(request.make_array('lores'), lores_height)
+                self.last_metadata = request.get_metadata()
+                if self.change_detector is not None and not self.change_detector.should_keep(self.last_luma):
+                    return None
+                img = request.make_image('main')
+            finally:
+                request.release()
+        return img, self.last_metadata
+
+    def capture_stack(self, plan, method='mean'):
+        """Capture plan['depth'] frames and combine them into one, returns (img, metadata)."""
+        from scripts.stacking import FrameStacker
+
+        stacker = FrameStacker(plan['depth'], method)
+        metadata = None
+        for _ in range(plan['depth']):
+            request = self.camera.capture_request()
+            try:
+                stacker.add(request.make_array('main'))
+                metadata = metadata or request.get_metadata()
+            finally:
+                request.release()
+
+        # Report the single exposure the stack stands in for: the mean of the sub-frames is
+        # as bright as one of them, brightened by scale, over the time of the whole stack
+        metadata = dict(
+            metadata,
+            ExposureTime=plan['sub_exposure'] * plan['depth'],
+            AnalogueGain=plan['sub_gain'] * plan['scale'] / plan['depth'],
+            StackDepth=plan['depth'],
+        )
+        result = stacker.result(plan['scale'])
+        self.last_luma = image_luma(result)
+        return Image.fromarray(result), metadata
+
+    def write_frame(self, img, exif, file_name, finish, overlay, captured_values=None):
+        """Encode and publish a frame captured into memory, runs on a frame queue worker."""
+        save_frame(self.config, img, exif, file_name, overlay, captured_values)
+        finish(True, captured_values)
+
+    def capture_bracket(self, exposures, controls, work_scale=0.25):
+        """Capture one frame per exposure time back-to-back and fuse them, returns (img, metadata)."""
+        # OpenCV is slow to import, only load it when bracketing is used
+        from scripts.exposure_fusion import fuse_exposures
+
+        frames = []
+        metadata = None
+        for i, exposure in enumerate(exposures):
+            exposure_controls = dict(controls, ExposureTime=exposure)
+            self.camera.set_controls(exposure_controls)
+            wait_for_settle(self.camera, exposure_controls, self.config, self.logging_enabled)
+            request = self.camera.capture_request()
+            try:
+                frames.append(request.make_array('main'))
+                if i == len(exposures) // 2:
+                    metadata = request.get_metadata()
+            finally:
+                request.release()
+
+        # Leave the camera on the middle exposure, which is what the control state says is applied
+        self.camera.set_controls(controls)
+        fused = fuse_exposures(frames, work_scale)
+        self.last_luma = image_luma(fused)
+        return Image.fromarray(fused), metadata
+
+    def configure_burst(self, settings):
+        """Switch the running camera to a video configuration for a burst."""
+        if self.camera is None:
+            self.open(self.config['hdr'])
+        elif self.stream_key is not None:
+            self.camera.stop()
+
+        # Automatic exposure within the frame duration, the still exposure would not fit
+        frame_duration = int(1000000 / settings.get('fps', 5))
+        controls = {key: value for key, value in build_day_controls(self.config).items() if key != 'AnalogueGain'}
+        controls['FrameDurationLimits'] = (frame_duration, frame_duration)
+
+        # The buffers are the ring the frames are pulled from
+        camera_config = self.camera.create_video_configuration(
+            main={"size": tuple(settings.get('size', [1920, 1080])), "format": "BGR888"},
+            buffer_count=settings.get('buffer_count', 6),
+            controls=controls
+        )
+        self.camera.configure(camera_config)
+        self.camera.start()
+
+        # Makes the next still reconfigure the camera
+        self.stream_key = ('burst',)
+        self.controls = controls
+        self.mode = 'burst'
+
+    def write_burst_frame(self, frame, file_name, output_size, meter):
+        """Downscale and encode one burst frame, runs on a burst worker."""
+        start = time.monotonic()
+        img = Image.fromarray(frame)
+        if output_size:
+            img = img.resize(tuple(output_size), Image.BILINEAR)
+        img.save(file_name, quality=self.config.get('burst', {}).get('quality', 90))
+        meter.frame_written(time.monotonic() - start)
+
+    def capture_burst(self):
+        """
+        Capture frames at burst.fps for burst.duration seconds, then leave the camera for the next still.
+
+        The loop only copies each frame out of the camera buffers and hands it to a pool of
+        workers that downscale and encode it. When the workers fall behind, frames are dropped
+        instead of stalling the sensor.
+        :return: The throughput report of the burst.
+        """
+        settings = self.config.get('burst', {})
+        self.configure_burst(settings)
+
+        folder = get_burst_folder(self.config)
+        pool = FrameQueue(settings.get('workers', 2), settings.get('max_pending', 8))
+        meter = ThroughputMeter()
+        end = time.monotonic() + settings.get('duration', 60)
+        index = 0
+        try:
+            while time.monotonic() < end:
+                request = self.camera.capture_request()
+                try:
+                    frame = request.make_array('main')
+                finally:
+                    request.release()
+                meter.frame_captured()
+
+                file_name = os.path.join(folder, f"frame_{index:05d}.jpg")
+                if pool.try_submit(self.write_burst_frame, frame, file_name, settings.get('output_size'), meter):
+                    index += 1
+                else:
+                    meter.frame_dropped()
+        finally:
+            pool.close()
+            meter.stop()
+        return meter.log_report(folder)
+
+    def capture_day(self, now=None):
+        """
+        Capture one image with day settings and return its path, or None if it was skipped.
+
+        :param now: Capture time the file is named after, the current time if None.
+        """
+        reset_to_daytime_settings(self.camera_num)
+        if self.exposure_controller is not None:
+            self.exposure_controller.reset()
+        self.apply('day', build_day_controls(self.config), self.config['hdr'])
+
+        file_name = get_image_path(self.config, now)
+        finish = lambda overlay_added, captured_values=None: finish_image(self.config, file_name, self.logging_enabled, overlay_added, captured_values)
+        if not self.capture(file_name, finish, now=now):
+            return None
+        return get_final_path(self.config, file_name)
+
+    def capture_night(self, shutter_speed, gain, test_mode=False, transition=False, colour_gains=None, now=None):
+        """
+        Capture one image with night settings and return its path, or None if it was skipped.
+
+        During sunset/sunrise transitions a bracket is fused when bracketing is enabled,
+        otherwise a stack of shorter exposures is combined when night_stacking is enabled.
+        With auto_exposure enabled the planned shutter speed and gain are corrected from the
+        brightness of the previous frames.
+        :param now: Capture time the file is named after, the current time if None.
+        """
+        planned_exposure = shutter_speed * gain
+        if self.exposure_controller is not None:
+            shutter_speed, gain = self.exposure_controller.correct(shutter_speed, gain)
+            print(f"Auto exposure offset {self.exposure_controller.offset:+.2f} stops: shutter_speed: {shutter_speed}, gain: {gain}")
+        exposure = shutter_speed * gain
+        # Stored before the capture so the overlay shows the values of this frame
+        save_camera_state(shutter_speed, gain, self.exposure_controller.offset if self.exposure_controller is not None else 0.0, self.camera_num)
+
+        stacking = self.config.get('night_stacking', {})
+        bracketing = self.config.get('bracketing', {})
+        grab = None
+        if transition and bracketing.get('enabled', False):
+            from scripts.exposure_fusion import bracket_exposures
+            exposures = bracket_exposures(shutter_speed, bracketing.get('ev_step', 1.0))
+            print(f"Bracketing exposures {exposures}")
+            grab = lambda: self.capture_bracket(exposures, controls, bracketing.get('work_scale', 0.25))
+        elif stacking.get('enabled', False):
+            # Take several shorter exposures instead of one long one and combine them
+            from scripts.stacking import plan_stack
+            constants = self.config['camera_constants']
+            plan = plan_stack(shutter_speed, gain, stacking.get('max_sub_exposure', 5000000), stacking.get('max_depth', 8), constants['MAX_GAIN'])
+            print(f"Stacking {plan['depth']} exposures of {plan['sub_exposure']} at gain {plan['sub_gain']}")
+            shutter_speed, gain = plan['sub_exposure'], plan['sub_gain']
+            grab = lambda: self.capture_stack(plan, stacking.get('method', 'mean'))
+
+        controls = build_night_controls(self.config, shutter_speed, gain, colour_gains)
+        print_camera_config({'controls': controls}, shutter_speed, gain)
+        self.apply('night', controls, False)
+
+        file_name = get_night_image_path(self.config, test_mode, now)
+        self.last_luma = None
+        finish = lambda overlay_added, captured_values=None: finish_night_image(self.config, file_name, self.logging_enabled, test_mode, overlay_added, captured_values)
+        stored = self.capture(file_name, finish, overlay=not test_mode, grab=grab, now=now)
+        if self.exposure_controller is not None and self.last_luma is not None:
+            ev_offset = self.exposure_controller.update(self.last_luma, exposure, planned_exposure)
+            get_camera_state(self.camera_num).update(ev_offset=ev_offset)
+        return get_final_path(self.config, file_name) if stored else None
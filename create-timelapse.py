@@ -2,15 +2,11 @@
 import os
 import subprocess
 import datetime
-import yaml
 import argparse
 from colored import fg, attr
 from scripts import ffmpeg as ff_script
 from scripts.logger import log_message
-
-def load_config(config_path):
-    with open(config_path, 'r') as config_file:
-        return yaml.safe_load(config_file)
+from scripts.config import load_config
 
 def create_timelapse(config, date=None, upload=True, debug=False, only_upload=False):
     # Get the specified or previous day's date
@@ -140,5 +136,5 @@ if __name__ == "__main__":
         print("Error: --only-upload and --dont-upload cannot be used together.")
         exit(1)
 
-    config = load_config('/home/pi/raspberrypi-picamera-timelapse/config.yaml')
+    config = load_config(sections=('images', 'overlay', 'video'))
     create_timelapse(config, args.date, not args.dont_upload, args.debug, args.only_upload)
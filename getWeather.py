@@ -1,39 +1,172 @@
 #!/usr/bin/python
-import requests
 import os
 import time
 import json
+import threading
 
-CACHE_FOLDER = "cache"
+# Next to the scripts, not in the working directory of whoever runs them
+CACHE_FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)), "cache")
 CACHE_FILE = os.path.join(CACHE_FOLDER, "netatmo.json")
 CACHE_EXPIRY = 300  # 5 minutes in seconds
+WEATHER_URL = "https://ekstremedia.no/api/weather/getWeatherForPi"
 
-def get_weather_data():
-    # Check if cache file exists and is newer than 5 minutes
-    if os.path.exists(CACHE_FILE) and time.time() - os.path.getmtime(CACHE_FILE) < CACHE_EXPIRY:
-        with open(CACHE_FILE, "r") as file:
-            return json.load(file)
+class WeatherProvider:
+    """
+    Serve the last good weather data right away and fetch new data in the background.
+
+    get() never waits for the API unless there is no data at all, and then only for the
+    given budget. Fetched data is written to the cache file with an atomic rename, so other
+    processes and the next start read either the old or the new data, never half of it.
+    """
+
+    def __init__(self, url=WEATHER_URL, cache_file=CACHE_FILE, refresh_interval=CACHE_EXPIRY, timeout=10):
+        self.url = url
+        self.cache_file = cache_file
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.data = None
+        self.fetched_at = None
+        self.refresh_thread = None
+        self.stop_event = threading.Event()
+        self.load_cache()
 
-    url = "https://ekstremedia.no/api/weather/getWeatherForPi"
+    def load_cache(self):
+        """Read the last good data from the cache file, if there is one."""
+        try:
+            with open(self.cache_file, "r") as file:
+                cached = json.load(file)
+            fetched_at = os.path.getmtime(self.cache_file)
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            if self.fetched_at is None or fetched_at > self.fetched_at:
+                self.data, self.fetched_at = cached, fetched_at
 
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for non-2xx status codes
-        weather_data = response.json()
+    def age(self):
+        """Return the seconds since the data was fetched, None if there is none."""
+        return None if self.fetched_at is None else max(0.0, time.time() - self.fetched_at)
 
-        # Save the data to the cache file
-        os.makedirs(CACHE_FOLDER, exist_ok=True)
-        with open(CACHE_FILE, "w") as file:
+    def save_cache(self, weather_data):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        temp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as file:
             json.dump(weather_data, file)
+        os.replace(temp_file, self.cache_file)
+
+    def refresh(self):
+        """Fetch the weather data now, returns True if it was updated."""
+        # requests takes a while to import
+        import requests
+
+        try:
+            response = requests.get(self.url, timeout=self.timeout)
+            response.raise_for_status()  # Raise an exception for non-2xx status codes
+            weather_data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print("Failed to fetch weather data:", e)
+            return False
+
+        with self.lock:
+            self.data, self.fetched_at = weather_data, time.time()
+        try:
+            self.save_cache(weather_data)
+        except OSError as e:
+            print("Failed to cache weather data:", e)
+        return True
+
+    def refresh_async(self):
+        """Start a refresh in the background unless one is running, returns its thread."""
+        with self.lock:
+            if self.refresh_thread is None or not self.refresh_thread.is_alive():
+                # A daemon, so a capture script exits right after its frame instead of
+                # waiting for the API; a fetch cut off that way is retried by the next run
+                self.refresh_thread = threading.Thread(target=self.refresh, name="weather-refresh", daemon=True)
+                self.refresh_thread.start()
+            return self.refresh_thread
+
+    def get(self, budget=0.5):
+        """
+        Return (weather data, age in seconds) without waiting for the API.
+
+        Stale data is returned as it is while a refresh runs in the background. Only when
+        there is no data at all, the caller waits up to budget seconds for the first fetch.
+        :return: (None, None) if there is no data yet.
+        """
+        age = self.age()
+        if age is None or age >= self.refresh_interval:
+            # Another process may have fetched it meanwhile
+            self.load_cache()
+            age = self.age()
+        if age is None or age >= self.refresh_interval:
+            thread = self.refresh_async()
+            if age is None and budget > 0:
+                thread.join(budget)
+        return self.data, self.age()
 
-        return weather_data
-    except requests.exceptions.RequestException as e:
-        print("Failed to fetch weather data:", e)
-        return None
+    def run(self):
+        while True:
+            age = self.age()
+            if age is None or age >= self.refresh_interval:
+                self.refresh_async().join()
+                age = self.age()
+            # After a failed fetch, try again in a minute rather than a whole interval
+            wait = self.refresh_interval - age if age is not None and age < self.refresh_interval else min(60, self.refresh_interval)
+            if self.stop_event.wait(wait):
+                return
 
+    def start(self):
+        """Keep the data fresh from a background thread, for long-running processes."""
+        self.stop_event.clear()
+        thread = threading.Thread(target=self.run, name="weather", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stop_event.set()
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+def get_weather_provider(config=None):
+    """Return the shared WeatherProvider of the weather config section."""
+    weather = (config or {}).get('weather', {})
+    cache_file = os.path.abspath(weather.get('cache_file', CACHE_FILE))
+    key = (weather.get('url', WEATHER_URL), cache_file, weather.get('refresh_interval', CACHE_EXPIRY), weather.get('timeout', 10))
+    with _providers_lock:
+        if key not in _providers:
+            _providers[key] = WeatherProvider(*key)
+        return _providers[key]
+
+def get_weather(config=None):
+    """
+    Return (weather data, age in seconds) for the overlay, within the weather.budget.
+
+    Data older than weather.max_age is not returned.
+    """
+    weather = (config or {}).get('weather', {})
+    weather_data, age = get_weather_provider(config).get(weather.get('budget', 0.5))
+    max_age = weather.get('max_age')
+    if age is not None and max_age is not None and age > max_age:
+        return None, age
+    return weather_data, age
+
+def start_weather_refresh(config):
+    """Start refreshing the weather data in the background, returns the provider to stop it."""
+    provider = get_weather_provider(config)
+    provider.start()
+    return provider
+
+def get_weather_data():
+    """Return the weather data, or None if there is none yet."""
+    return get_weather()[0]
 
-weather_data = get_weather_data()
+if __name__ == "__main__":
+    provider = get_weather_provider()
+    provider.refresh()
+    weather_data, age = provider.get()
 
-if weather_data is not None:
-    # Process the weather data as needed
-    print(weather_data)
+    if weather_data is not None:
+        # Process the weather data as needed
+        print(weather_data)
+        print(f"Fetched {age:.0f}s ago")
@@ -1,35 +1,20 @@
 #!/usr/bin/python
 from PIL import Image, ImageDraw, ImageFont
-import yaml
 import os
-import time
 import math
 import shutil
-import sys
 import logging
 import argparse
-import json
-from getWeather import get_weather_data
+from datetime import datetime
+from functools import lru_cache
+from getWeather import get_weather
+from scripts.camera_state import get_camera_state
+from scripts.config import load_config
 
-# Add the scripts directory to Python's module path
-sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'scripts'))
-
-def load_camera_state_from_json():
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    camera_state_file = os.path.join(script_dir, 'data', 'camera_state.json')
-    
-    try:
-        with open(camera_state_file, "r") as file:
-            state = json.load(file)
-            return state["shutter_speed"], state["gain"]
-    except (FileNotFoundError, KeyError):
-        return None, None
-
-# Load configuration from yaml file
-def load_config(config_path):
-    with open(config_path, 'r') as config_file:
-        config = yaml.safe_load(config_file)
-    return config
+def load_camera_state(camera_num=0):
+    """Return the shutter speed and gain from the shared camera state."""
+    state = get_camera_state(camera_num).snapshot()
+    return state.get("shutter_speed"), state.get("gain")
 
 # Set up logging
 def setup_logging(config):
@@ -42,85 +27,101 @@ def setup_logging(config):
     else:
         return False
 
+FONT_BOLD = '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'
+FONT_REGULAR = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+# The band is drawn over the top 40 rows of the image as well
+BAND_HEIGHT = 120
+IMAGE_OFFSET = 80
+
+DAY_NAMES = ['Mandag', 'Tirsdag', 'Onsdag', 'Torsdag', 'Fredag', 'Lørdag', 'Søndag']
+PI_KEYS = ('CPU Temperature', 'Used Disk Space', 'Total Disk Space', 'Disk Usage Percentage', 'Photos Captured Today', 'Total Size of Photos')
+# Netatmo module and fields shown in the band, the rest of the weather data is not kept
+WEATHER_FIELDS = {
+    '02:00:00:5f:3f:f8': ('Temperature',),
+    '06:00:00:05:7b:ca': ('WindStrength', 'WindAngle'),
+    '05:00:00:06:5f:30': ('Rain',),
+}
+MONTH_NAMES = ['januar', 'februar', 'mars', 'april', 'mai', 'juni', 'juli', 'august', 'september', 'oktober', 'november', 'desember']
+
+@lru_cache(maxsize=16)
+def get_font(path, size):
+    return ImageFont.truetype(path, size)
+
+@lru_cache(maxsize=64)
+def render_text(text, font_path, size, fill):
+    """
+    Rasterize text once into a transparent layer, returns (layer, offset from the text position).
+
+    The layer is pasted with itself as mask, which gives the same result as drawing the text
+    onto the band directly. Text that stays the same between frames is not rasterized again.
+    """
+    font = get_font(font_path, size)
+    left, top, right, bottom = font.getbbox(text)
+    layer = Image.new('RGBA', (max(right - left, 1), max(bottom - top, 1)), fill + (0,))
+    ImageDraw.Draw(layer).text((-left, -top), text, font=font, fill=fill)
+    return layer, (left, top)
 
-# Load the configuration file
-config = load_config('/home/pi/raspberrypi-picamera-timelapse/config.yaml')
+def paste_text(band, xy, text, font_path, size, fill=(255, 255, 255)):
+    layer, (left, top) = render_text(text, font_path, size, fill)
+    band.paste(layer, (xy[0] + left, xy[1] + top), layer)
 
-# Set up logging
-logging_enabled = setup_logging(config)
+def text_width(text, font_path, size):
+    return get_font(font_path, size).getbbox(text)[2]
 
 # Create gradient for overlay
-def create_gradient(draw, width):
-    for y in range(120):
-        r, g, b = 10, 20, 40 + int((64 / 60) * y)
-        draw.line([(0, y), (width, y)], fill=(r, g, b))
+def create_gradient(width):
+    """Return the band background, one column of the gradient stretched to width."""
+    column = Image.new('RGB', (1, BAND_HEIGHT))
+    column.putdata([(10, 20, 40 + int((64 / 60) * y)) for y in range(BAND_HEIGHT)])
+    return column.resize((width, BAND_HEIGHT), Image.NEAREST)
 
 # Draw overlay with camera name
-def draw_camera_name(draw, width, config):
-    font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', 50)
+def draw_camera_name(band, width, config):
     text = f"{config['camera_name']}"
-    text_x = (width - draw.textbbox(xy=(0, 0), text=text, font=font)[2]) // 2 + 20
+    text_x = (width - text_width(text, FONT_BOLD, 50)) // 2 + 20
     text_y = 5
-    draw.text((text_x, text_y), text, font=font, fill=(255, 255, 255))
+    paste_text(band, (text_x, text_y), text, FONT_BOLD, 50)
 
-# Draw date on overlay
-def draw_date(draw, width):
-    # Create dictionaries of day and month names
-    day_names = {
-        'Monday': 'Mandag',
-        'Tuesday': 'Tirsdag',
-        'Wednesday': 'Onsdag',
-        'Thursday': 'Torsdag',
-        'Friday': 'Fredag',
-        'Saturday': 'Lørdag',
-        'Sunday': 'Søndag',
-    }
-    month_names = {
-        'January': 'januar',
-        'February': 'februar',
-        'March': 'mars',
-        'April': 'april',
-        'May': 'mai',
-        'June': 'juni',
-        'July': 'juli',
-        'August': 'august',
-        'September': 'september',
-        'October': 'oktober',
-        'November': 'november',
-        'December': 'desember',
-    }
+@lru_cache(maxsize=4)
+def get_static_band(width, camera_name):
+    """Return the parts of the band that never change for a camera: the gradient and the camera name."""
+    band = create_gradient(width)
+    draw_camera_name(band, width, {'camera_name': camera_name})
+    return band
 
-    # Get the date as a string
-    date_text = time.strftime('%A, %d. %B %Y %H:%M')
+def format_date(now=None):
+    """Return the date line in Norwegian, e.g. 'Lørdag, 18. oktober 2026 12:00'."""
+    now = now or datetime.now()
+    return f"{DAY_NAMES[now.weekday()]}, {now.day:02d}. {MONTH_NAMES[now.month - 1]} {now.year} {now.strftime('%H:%M')}"
 
-    # Replace the English day and month names with the Norwegian names
-    for eng, nor in day_names.items():
-        date_text = date_text.replace(eng, nor)
-    for eng, nor in month_names.items():
-        date_text = date_text.replace(eng, nor)
-        
-    date_font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', 40)
-    date_x = (width - draw.textbbox(xy=(0, 0), text=date_text, font=date_font)[2]) // 2 + 20
+# Draw date on overlay
+def draw_date(band, width, now=None):
+    date_text = format_date(now)
+    date_x = (width - text_width(date_text, FONT_BOLD, 40)) // 2 + 20
     date_y = 68
-    draw.text(xy=(date_x, date_y), text=date_text, font=date_font, fill=(255, 255, 255))
+    paste_text(band, (date_x, date_y), date_text, FONT_BOLD, 40)
+
+@lru_cache(maxsize=8)
+def get_weather_icon(symbol):
+    """Return the yr icon for a weather symbol resized to the band, or None if there is none."""
+    weather_icon_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'yrimg', f"{symbol}.png")
+    if not os.path.isfile(weather_icon_path):
+        return None
+    with Image.open(weather_icon_path) as icon:
+        weather_icon = icon.convert('RGBA')
+    transparent_icon = Image.new('RGBA', weather_icon.size, (255, 255, 255, 0))
+    transparent_icon.paste(weather_icon, (0, 0), weather_icon)
+    return transparent_icon.resize((120, 120))
 
 # Draw weather icon on overlay
-def draw_weather_icon(new_img, weather_data, width):
-    symbol = weather_data.get('symbol')
-    # symbol = "lightsleetandthunder"
-    weather_icon_path = f"/home/pi/raspberrypi-picamera-timelapse/yrimg/{symbol}.png"
-
-    if os.path.isfile(weather_icon_path):
-        weather_icon = Image.open(weather_icon_path).convert('RGBA')
-        transparent_icon = Image.new('RGBA', weather_icon.size, (255, 255, 255, 0))
-        transparent_icon.paste(weather_icon, (0, 0), weather_icon)
-        transparent_icon = transparent_icon.resize((120, 120))
-
+def draw_weather_icon(band, weather_data, width):
+    transparent_icon = get_weather_icon(weather_data.get('symbol'))
+    if transparent_icon is not None:
         icon_x = 10
         icon_y = (100 - transparent_icon.height) // 2
-        new_img.paste(transparent_icon, (icon_x, icon_y), transparent_icon)
+        band.paste(transparent_icon, (icon_x, icon_y), transparent_icon)
 
-def draw_weather_data(draw, weather_data):
+def draw_weather_data(band, draw, weather_data):
     # Define the starting point and spacing for the weather data
     temp_x = 180
     rain_x = 500
@@ -137,21 +138,15 @@ def draw_weather_data(draw, weather_data):
         wind_direction = int(weather_data['06:00:00:05:7b:ca']['WindAngle'])
         rain = f"{weather_data['05:00:00:06:5f:30']['Rain']} mm"
 
-
-        # Define the font for the weather data
-        data_font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', 60)
-
         # Draw the weather data on the image
-        
-        draw.text((temp_x, data_y), f"{temperature}", font=data_font, fill=(255, 255, 255))
-        
-        
+        paste_text(band, (temp_x, data_y), f"{temperature}", FONT_BOLD, 60)
+
         wind_line = f"{wind_speed} fra {wind_direction}°"
-        draw.text((rain_x, data_y), f"{rain}", font=data_font, fill=(255, 255, 255))
-        draw.text((wind_x, data_y), wind_line, font=data_font, fill=(255, 255, 255))
+        paste_text(band, (rain_x, data_y), f"{rain}", FONT_BOLD, 60)
+        paste_text(band, (wind_x, data_y), wind_line, FONT_BOLD, 60)
 
         # Draw the wind direction arrow
-        draw_wind_direction_arrow(draw, wind_icon_x, wind_icon_y, 0, wind_line, data_font, wind_direction)
+        draw_wind_direction_arrow(draw, wind_icon_x, wind_icon_y, 0, wind_line, get_font(FONT_BOLD, 60), wind_direction)
 
 def draw_wind_direction_arrow(draw, data_x, data_y, data_spacing, wind_line, data_font, wind_direction):
     # Define the starting point for the arrow
@@ -180,20 +175,27 @@ def draw_wind_direction_arrow(draw, data_x, data_y, data_spacing, wind_line, dat
     # Draw the arrow on the image
     draw.polygon([(x1, y1 - arrow_length), (x2, y2 - arrow_length), (x3, y3 - arrow_length)], fill=(255, 255, 255))
 
-def draw_pi_info(draw):
-    from piDataStats import get_pi_data
+def get_pi_values(config=None):
+    """Return the Pi stats shown in the band, from the latest system metrics sample if a sampler runs."""
+    if config is not None and config.get('system_metrics', {}).get('enabled', False):
+        from scripts.system_metrics import get_latest_sample, format_pi_values
+        sample = get_latest_sample(config)
+        if sample is not None:
+            data = format_pi_values(sample)
+            return {key: data[key] for key in PI_KEYS if key in data}
+
+    # No sampler running, measure everything now
+    from scripts.piDataStats import get_pi_data
     data = get_pi_data()
     # {'CPU Temperature': '40.4', 'Total Memory': '3.53 GB', 'Used Memory': '971.80 MB', 'Memory Usage Percentage': '28.80 %', 'Total Disk Space': '114.21 GB', 
     # 'Used Disk Space': '7.49 GB', 'Free Disk Space': '102.05 GB', 'Disk Usage Percentage': '6.80 %', 'Load Average': '0.40, 0.24, 0.19', 'Photos Captured Today': 1340, 
     # 'Total Size of Photos': '377.92 MB'}
+    return {key: data[key] for key in PI_KEYS if key in data}
 
+def draw_pi_info(band, data, shutter_speed, gain):
     temp_x = 2420
     temp_y = 16
     space_y = 62
-    data_font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 35)
-
-    # Load the shutter_speed and gain
-    shutter_speed, gain = load_camera_state_from_json()
 
     if shutter_speed is not None and gain is not None:
         camera_state_line = f"Shutter speed: {shutter_speed}, Gain: {gain}"
@@ -212,97 +214,211 @@ def draw_pi_info(draw):
         topStr = f"{rpi}, {cpu_temperature}, {camera_state_line}"
         secondStr = f"{space} - {photos}"
 
-        # Define the font for the  data
-
         # Draw the data on the image
-        draw.text((temp_x, temp_y),topStr, font=data_font, fill=(220, 220, 255))    
-        draw.text((temp_x, space_y),secondStr, font=data_font, fill=(220, 220, 255))    
+        paste_text(band, (temp_x, temp_y), topStr, FONT_REGULAR, 35, (220, 220, 255))
+        paste_text(band, (temp_x, space_y), secondStr, FONT_REGULAR, 35, (220, 220, 255))
+
+def get_pi_history(config):
+    """Return the recent CPU temperature and load for the sparklines, None if they are off."""
+    metrics = config.get('system_metrics', {})
+    if not (metrics.get('enabled', False) and metrics.get('sparklines', False)):
+        return None
+    from scripts.system_metrics import get_recent_samples
+    samples = get_recent_samples(config, metrics.get('sparkline_points', 60))
+    return {
+        'cpu_temp': [sample['cpu_temp'] for sample in samples],
+        'load1': [round(sample['load1'], 2) for sample in samples],
+    }
 
-def crop_and_resize_image(file_path, crop_dimensions, new_size):
+def draw_sparkline(band, box, series, fill=(220, 220, 255)):
+    """Draw series as a line scaled to fill box (left, top, right, bottom)."""
+    points = [value for value in series if value is not None]
+    if len(points) < 2:
+        return
+    left, top, right, bottom = box
+    low, high = min(points), max(points)
+    step = (right - left) / (len(points) - 1)
+    # A flat series is drawn through the middle
+    line = [(left + i * step, bottom - ((value - low) / (high - low) if high > low else 0.5) * (bottom - top)) for i, value in enumerate(points)]
+    ImageDraw.Draw(band).line(line, fill=fill, width=2)
+
+def draw_pi_history(band, width, history):
+    """Draw the CPU temperature and load sparklines at the right end of the band."""
+    spark_x = width - 240
+    for (label, key), top in ((("CPU", 'cpu_temp'), 16), (("Last", 'load1'), 62)):
+        paste_text(band, (spark_x - 70, top + 6), label, FONT_REGULAR, 22, (220, 220, 255))
+        draw_sparkline(band, (spark_x, top, spark_x + 220, top + 40), history.get(key, []))
+
+def get_crop_dimensions(config):
+    """Return the (left, top, right, bottom) cropping box if cropping is enabled, otherwise None."""
+    # Check if cropping is enabled and the necessary dimensions are available in the configuration
+    if not (config.get('crop_image', False) and 'main_size' in config and 'crop_size' in config):
+        return None
+
+    # Calculate the cropping dimensions (left, top, right, bottom)
+    crop_size = tuple(config['crop_size'])
+    return (0, 0, crop_size[0], crop_size[1])
+
+def crop_and_resize_image(img, crop_dimensions, new_size):
     """
     Crop and resize the image.
 
-    :param file_path: Path to the image file.
+    :param img: PIL image to crop.
     :param crop_dimensions: Tuple of (left, top, right, bottom) defining the cropping box.
     :param new_size: Tuple of (width, height) defining the new size of the image.
+    :return: The cropped and resized image.
     """
-    with Image.open(file_path) as img:
-        # Crop the image
-        cropped_img = img.crop(crop_dimensions)
-        
-        # Resize the image
-        resized_img = cropped_img.resize(new_size)
-        
-        # Save the modified image back to the original file path
-        resized_img.save(file_path)    
-        print("Cropping image")
-
-def add_overlay(config, image_path):
-
-    print("Add_overlay started")
-
-    # Check if cropping is enabled and the necessary dimensions are available in the configuration
-    if config.get('crop_image', False) and 'main_size' in config and 'crop_size' in config:
-        # Retrieve the main size and crop size from the configuration
-        main_size = tuple(config['main_size'])
-        crop_size = tuple(config['crop_size'])
-        
-        # Calculate the cropping dimensions (left, top, right, bottom)
-        left = 0
-        top = 0
-        right = crop_size[0]
-        bottom = crop_size[1]
-        crop_dimensions = (left, top, right, bottom)
-        
-        # Crop and resize the image
-        crop_and_resize_image(image_path, crop_dimensions, main_size)
-
-    test_mode = False
-    # if test_mode == True:
-    #     print("TEST MODE")
-    # Open the image and get its size
-    img = Image.open(image_path)
-    width, height = img.size
-    exif_data = img.info.get('exif', b'')
-
-    # Create a new image with additional height for the overlay
-    new_height = height + 80
-    new_img = Image.new('RGB', (width, new_height), (255, 255, 255))
-    new_img.paste(img, (0, 80))
+    print("Cropping image")
+    return img.crop(crop_dimensions).resize(new_size)
+
+def get_weather_values(weather_data):
+    """Return the part of the weather data shown in the band, None if there is none."""
+    if not weather_data:
+        return None
+    values = {'symbol': weather_data.get('symbol')}
+    for module, fields in WEATHER_FIELDS.items():
+        if module in weather_data:
+            values[module] = {field: weather_data[module].get(field) for field in fields}
+    return values
+
+def collect_capture_values(config, now=None):
+    """
+    Return the overlay values that belong to the moment of capture: time, camera and exposure.
 
-    # Create a draw object for the new image
-    draw = ImageDraw.Draw(new_img)
+    They are cheap to collect, so the capture thread takes them before it hands the frame
+    to the frame queue.
+    """
+    now = now or datetime.now()
+    camera_num = config.get('camera_num', 0)
+    shutter_speed, gain = load_camera_state(camera_num)
+    return {
+        'time': now.isoformat(timespec='seconds'),
+        'camera_name': config['camera_name'],
+        'camera_num': camera_num,
+        'shutter_speed': shutter_speed,
+        'gain': gain,
+    }
 
-    # Draw the gradient, overlay, and date on the new image
-    create_gradient(draw, width)
-    draw_camera_name(draw, width, config)
-    draw_date(draw, width)
-    draw_pi_info(draw)
+def collect_overlay_values(config, now=None, captured_values=None):
+    """
+    Return everything the band shows for a frame captured now.
 
+    The values are plain JSON types, so they can be stored with the frame and the band
+    rendered later with render_values_band.
+    :param captured_values: Values from collect_capture_values taken when the frame was
+        captured, the weather and Pi stats are added to them.
+    """
+    if captured_values is None:
+        captured_values = collect_capture_values(config, now)
+    logging_enabled = config.get('log_overlay', False)
 
-    # Attempt to get the weather data
+    # The last good weather data, fetched in the background when it is stale
+    weather_age = None
     try:
-        weather_data = get_weather_data()
+        weather_data, weather_age = get_weather(config)
+        weather = get_weather_values(weather_data)
         if logging_enabled:
-            logging.info("Weather data retrieved successfully.")
-        # Attempt to draw the weather icon and data on the new image
-        try:
-            draw_weather_icon(new_img, weather_data, width)
-            draw_weather_data(draw, weather_data)
-        except Exception as e:
-            print(f"Failed to load weather data: {e}")            
-
+            logging.info(f"Weather data retrieved, {weather_age:.0f}s old." if weather_age is not None else "No weather data yet.")
     except Exception as e:
         print(f"Failed to get weather data: {e}")
-        weather_data = None
+        weather = None
         if logging_enabled:
             logging.error(f"Failed to get weather data: {e}")
 
+    values = dict(
+        captured_values,
+        weather=weather,
+        weather_age=None if weather_age is None else round(weather_age),
+        pi=get_pi_values(config),
+    )
+    pi_history = get_pi_history(config)
+    if pi_history is not None:
+        values['pi_history'] = pi_history
+    return values
+
+def render_values_band(values, width):
+    """
+    Return the overlay band showing the given values for an image of the given width.
+
+    The gradient and camera name are rendered once per width, fonts and weather icons are
+    loaded once, and each text is only rasterized again when its value changes.
+    """
+    band = get_static_band(width, values['camera_name']).copy()
+    draw = ImageDraw.Draw(band)
+    draw_date(band, width, datetime.fromisoformat(values['time']))
+    draw_pi_info(band, values['pi'], values['shutter_speed'], values['gain'])
+    if values.get('pi_history'):
+        draw_pi_history(band, width, values['pi_history'])
+
+    # Attempt to draw the weather icon and data on the new image
+    if values['weather'] is not None:
+        try:
+            draw_weather_icon(band, values['weather'], width)
+            draw_weather_data(band, draw, values['weather'])
+        except Exception as e:
+            print(f"Failed to load weather data: {e}")
+    return band
+
+def render_band(config, width, now=None):
+    """Return the overlay band for an image of the given width with the current values."""
+    return render_values_band(collect_overlay_values(config, now), width)
+
+def render_overlay(config, img, now=None, values=None):
+    """
+    Crop the image if enabled and return a new image with the overlay band on top.
+
+    Works entirely in memory, the caller decides when and how the result is encoded.
+    :param values: Overlay values recorded for the frame, the current values are used if None.
+    """
+    crop_dimensions = get_crop_dimensions(config)
+    if crop_dimensions:
+        img = crop_and_resize_image(img, crop_dimensions, tuple(config['main_size']))
+
+    width, height = img.size
+    band = render_values_band(values, width) if values is not None else render_band(config, width, now)
+
+    # Create a new image with additional height for the overlay, left unfilled since the image and band cover it all
+    new_img = Image.new('RGB', (width, height + IMAGE_OFFSET), None)
+    new_img.paste(img, (0, IMAGE_OFFSET))
+    new_img.paste(band, (0, 0))
+    return new_img
+
+def overlay_sidecar(config):
+    """Return True if the overlay values are stored next to the frames instead of drawn on them."""
+    return config['overlay'].get('mode', 'burn') == 'sidecar'
+
+def record_overlay(config, file_name, captured_values=None):
+    """
+    Collect the overlay values for a frame and return them.
+
+    In sidecar mode, or with overlay.record_values in burn mode, they are also stored in the
+    overlay.jsonl of the frame's final folder, marked with whether the band is burned in.
+    :param captured_values: Values from collect_capture_values taken when the frame was
+        captured, the current time and exposure are used if None.
+    """
+    values = collect_overlay_values(config, captured_values=captured_values)
+    sidecar = overlay_sidecar(config)
+    if sidecar or config['overlay'].get('record_values', False):
+        from scripts.overlay_metadata import record_overlay_values
+        from scripts.staging import get_final_path
+        record_overlay_values(get_final_path(config, file_name), dict(values, burned=not sidecar))
+    return values
+
+def add_overlay(config, image_path, output_path=None, values=None):
 
+    print("Add_overlay started")
+
+    test_mode = False
+    # if test_mode == True:
+    #     print("TEST MODE")
+    # Open the image and keep its EXIF data
+    with Image.open(image_path) as img:
+        exif_data = img.info.get('exif', b'')
+        new_img = render_overlay(config, img, values=values)
 
     # # Save the new image and copy it to the status file location
     if not test_mode:
-        new_img.save(image_path, exif=exif_data)
+        new_img.save(output_path or image_path, exif=exif_data)
     else:
         new_img.save("/var/www/html/overlay.jpg", exif=exif_data)
 
@@ -317,6 +433,9 @@ def add_overlay(config, image_path):
 
 if __name__ == "__main__":
     print("__main__ started")
+    config = load_config()
+    logging_enabled = setup_logging(config)
+
     # Parse command line arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('--file', help='The file path of the image.')
@@ -336,23 +455,3 @@ if __name__ == "__main__":
         print(f"Failed to add overlay: {e}")
         if logging_enabled:
             logging.error(f"Failed to add overlay: {e}")
-    # Parse command line arguments
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--file', help='The file path of the image.')
-    parser.add_argument('--test', action='store_true', help='Enable test mode.')
-    args = parser.parse_args()
-
-    # Log the image path
-    if logging_enabled:
-        logging.info(f"Image path: {args.file}")
-
-    # Attempt to get the weather data
-    try:
-        weather_data = get_weather_data()
-        if logging_enabled:
-            logging.info("Weather data retrieved successfully.")
-    except Exception as e:
-        print(f"Failed to get weather data: {e}")
-        weather_data = None
-        if logging_enabled:
-            logging.error(f"Failed to get weather data: {e}")
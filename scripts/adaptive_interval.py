@@ -0,0 +1,90 @@
+#!/usr/bin/python
+import os
+import math
+import time
+
+def lerp(x, x_min, x_max, y_min, y_max):
+    return y_min + (x - x_min) / (x_max - x_min) * (y_max - y_min)
+
+def clamp(value, low, high):
+    return max(low, min(high, value))
+
+class AdaptiveInterval:
+    """
+    Choose the capture interval from how fast the light and the scene are changing.
+
+    Light change is measured as the exposure (shutter speed x gain) change in stops per
+    minute, scene activity is the lores difference score from SceneChangeDetector. The
+    faster of the two decides where the interval lands between max_interval (nothing
+    happening) and min_interval. The interval never gets shorter than the exposure itself
+    plus exposure_overhead, and it shortens immediately but lengthens gradually.
+    """
+
+    def __init__(self, min_interval, max_interval, activity_low=0.005, activity_high=0.05,
+                 ev_rate_high=0.1, exposure_overhead=5, smoothing=0.3, clock=time.monotonic):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.activity_low = activity_low
+        self.activity_high = activity_high
+        self.ev_rate_high = ev_rate_high
+        self.exposure_overhead = exposure_overhead
+        self.smoothing = smoothing
+        self.clock = clock
+        self.interval = max_interval
+        self.previous_ev = None
+        self.previous_time = None
+        self.ev_rate = 0.0
+
+    def update_ev_rate(self, shutter_speed, gain):
+        """Update and return the exposure change rate in stops per minute."""
+        now = self.clock()
+        ev = math.log2(max(shutter_speed, 1) * max(gain, 1))
+        if self.previous_ev is not None and now > self.previous_time:
+            self.ev_rate = abs(ev - self.previous_ev) / (now - self.previous_time) * 60
+        self.previous_ev = ev
+        self.previous_time = now
+        return self.ev_rate
+
+    def next_interval(self, shutter_speed, gain, activity=None):
+        """Return the interval in seconds until the next frame."""
+        urgency = 0.0
+        if shutter_speed:
+            urgency = clamp(self.update_ev_rate(shutter_speed, gain or 1) / self.ev_rate_high, 0.0, 1.0)
+        if activity is not None:
+            urgency = max(urgency, clamp(lerp(activity, self.activity_low, self.activity_high, 0.0, 1.0), 0.0, 1.0))
+
+        target = lerp(urgency, 0.0, 1.0, self.max_interval, self.min_interval)
+        if target < self.interval:
+            self.interval = target
+        else:
+            self.interval += self.smoothing * (target - self.interval)
+
+        # Long exposures need the time to actually be taken
+        exposure_floor = (shutter_speed or 0) / 1000000 + self.exposure_overhead
+        self.interval = clamp(max(self.interval, exposure_floor), self.min_interval, max(self.max_interval, exposure_floor))
+        return self.interval
+
+def create_adaptive_interval(config):
+    """Create an AdaptiveInterval from the adaptive_interval config section, or None if it is disabled."""
+    settings = config.get('adaptive_interval', {})
+    if not settings.get('enabled', False):
+        return None
+    return AdaptiveInterval(
+        settings.get('min_interval', config['interval']),
+        settings.get('max_interval', config['interval']),
+        activity_low=settings.get('activity_low', 0.005),
+        activity_high=settings.get('activity_high', 0.05),
+        ev_rate_high=settings.get('ev_rate_high', 0.1),
+        exposure_overhead=settings.get('exposure_overhead', 5),
+        smoothing=settings.get('smoothing', 0.3)
+    )
+
+def record_interval(log_path, file_name, interval, shutter_speed, gain, activity):
+    """Append the interval chosen after a frame to a CSV file."""
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    write_header = not os.path.exists(log_path)
+    with open(log_path, 'a') as log_file:
+        if write_header:
+            log_file.write("time,file,interval,shutter_speed,gain,activity\n")
+        activity_str = f"{activity:.4f}" if activity is not None else ""
+        log_file.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')},{file_name or ''},{interval:.1f},{shutter_speed or ''},{gain or ''},{activity_str}\n")
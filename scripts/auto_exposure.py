@@ -0,0 +1,114 @@
+#!/usr/bin/python
+import math
+import numpy as np
+from .exposure_plan import split_exposure
+from .adaptive_interval import clamp
+
+def luma_histogram(luma):
+    """Return the 256 bin histogram of a luma array."""
+    return np.bincount(np.asarray(luma, dtype=np.uint8).ravel(), minlength=256)
+
+def luminance_stats(luma, percentile=0.99):
+    """
+    Measure the brightness of a luma array from its histogram.
+
+    :return: Tuple of (mean, percentile value), both scaled to 0-1.
+    """
+    histogram = luma_histogram(luma)
+    count = histogram.sum()
+    if count == 0:
+        return 0.0, 0.0
+    mean = float(np.dot(histogram, np.arange(256))) / count
+    level = int(np.searchsorted(np.cumsum(histogram), percentile * count))
+    return mean / 255.0, min(level, 255) / 255.0
+
+def image_luma(array, step=8):
+    """Return a subsampled gray version of an RGB frame array, enough to meter on."""
+    return array[::step, ::step, :3].mean(axis=2)
+
+class ExposureController:
+    """
+    Correct the planned night exposure from the measured brightness of the frames.
+
+    The correction is an offset in stops on top of the exposure plan. After each frame the
+    metered value (mean or a percentile of the luma histogram) is compared with the target,
+    and the offset moves toward the value that would have hit it. Each move is smoothed and
+    limited to max_step stops, and the offset never leaves max_offset or the exposure range
+    the camera constants allow.
+    """
+
+    def __init__(self, min_exposure, max_exposure, exposure_limits, target=0.2, metering='mean',
+                 percentile=0.99, max_step=1.0, smoothing=0.5, max_offset=4.0, offset=0.0):
+        if metering not in ('mean', 'percentile'):
+            raise ValueError(f"Unknown metering: {metering}")
+        self.min_exposure = min_exposure
+        self.max_exposure = max_exposure
+        # (day shutter, day gain, max shutter, max gain) for splitting the exposure
+        self.exposure_limits = exposure_limits
+        self.target = target
+        self.metering = metering
+        self.percentile = percentile
+        self.max_step = max_step
+        self.smoothing = smoothing
+        self.max_offset = max_offset
+        self.offset = offset
+        self.last_brightness = None
+
+    def reset(self):
+        """Go back to the planned exposure, e.g. after a day period."""
+        self.offset = 0.0
+        self.last_brightness = None
+
+    def measure(self, luma):
+        """Return the metered brightness (0-1) of a luma array."""
+        mean, percentile = luminance_stats(luma, self.percentile)
+        self.last_brightness = mean if self.metering == 'mean' else percentile
+        return self.last_brightness
+
+    def correct(self, shutter_speed, gain):
+        """Apply the current offset to a planned exposure, returns (shutter speed, gain)."""
+        exposure = clamp(shutter_speed * gain * 2 ** self.offset, self.min_exposure, self.max_exposure)
+        shutter_speed, gain = split_exposure(exposure, *self.exposure_limits)
+        return int(shutter_speed), round(float(gain), 2)
+
+    def update(self, luma, exposure, planned_exposure):
+        """
+        Update the offset from a frame.
+
+        :param luma: Luma array of the frame.
+        :param exposure: Shutter speed x gain the frame was taken with.
+        :param planned_exposure: Shutter speed x gain the plan had for the frame.
+        :return: The new offset in stops.
+        """
+        # Black frames still give a finite error, the step limit does the rest
+        brightness = max(self.measure(luma), 0.5 / 255)
+        wanted = math.log2(exposure) + math.log2(self.target / brightness) - math.log2(planned_exposure)
+
+        # Don't wind up past what the camera can do
+        low = max(-self.max_offset, math.log2(self.min_exposure / planned_exposure))
+        high = min(self.max_offset, math.log2(self.max_exposure / planned_exposure))
+        wanted = clamp(wanted, low, high)
+
+        step = clamp((1 - self.smoothing) * (wanted - self.offset), -self.max_step, self.max_step)
+        self.offset = clamp(self.offset + step, low, high)
+        return self.offset
+
+def create_exposure_controller(config, offset=0.0):
+    """Create an ExposureController from the auto_exposure config section, or None if it is disabled."""
+    settings = config.get('auto_exposure', {})
+    if not settings.get('enabled', False):
+        return None
+    constants = config['camera_constants']
+    limits = (constants['DAYTIME_SHUTTER'], constants['DAYTIME_GAIN'], constants['MAX_SHUTTER'], constants['MAX_GAIN'])
+    return ExposureController(
+        constants['DAYTIME_SHUTTER'] * constants['DAYTIME_GAIN'],
+        constants['MAX_SHUTTER'] * constants['MAX_GAIN'],
+        limits,
+        target=settings.get('target', 0.2),
+        metering=settings.get('metering', 'mean'),
+        percentile=settings.get('percentile', 0.99),
+        max_step=settings.get('max_step', 1.0),
+        smoothing=settings.get('smoothing', 0.5),
+        max_offset=settings.get('max_offset', 4.0),
+        offset=offset
+    )
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+import os
+import time
+import threading
+from datetime import datetime
+from .logger import log_message
+
+class BurstTrigger:
+    """
+    Decide when to switch from stills to a burst.
+
+    A burst starts when the trigger file exists (it is removed, so one touch gives one burst)
+    or when the scene activity reaches activity_threshold. After a burst no new one starts
+    for cooldown seconds, so a long storm becomes a series of bursts with stills in between.
+    """
+
+    def __init__(self, trigger_file=None, activity_threshold=None, cooldown=300, clock=time.monotonic):
+        self.trigger_file = trigger_file
+        self.activity_threshold = activity_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.last_burst = None
+
+    def check(self, activity=None):
+        """Return the reason for a burst ('trigger file' or 'activity'), or None."""
+        reason = None
+        if self.trigger_file and os.path.exists(self.trigger_file):
+            os.remove(self.trigger_file)
+            reason = 'trigger file'
+        elif self.activity_threshold is not None and activity is not None and activity >= self.activity_threshold:
+            if self.last_burst is None or self.clock() - self.last_burst >= self.cooldown:
+                reason = 'activity'
+        if reason is not None:
+            self.last_burst = self.clock()
+        return reason
+
+def create_burst_trigger(config):
+    """Create a BurstTrigger from the burst config section, or None if bursts are disabled."""
+    settings = config.get('burst', {})
+    if not settings.get('enabled', False):
+        return None
+    return BurstTrigger(settings.get('trigger_file'), settings.get('activity_threshold'), settings.get('cooldown', 300))
+
+def get_burst_folder(config, now=None):
+    """Return a new folder for the frames of one burst, next to the stills of the day."""
+    now = now or datetime.now()
+    day_folder = os.path.join(config['image_output']['root_folder'], now.strftime(config['image_output']['folder_structure']))
+    folder = os.path.join(day_folder, 'burst', now.strftime('%H_%M_%S'))
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+class ThroughputMeter:
+    """Count captured, written and dropped burst frames and time the writes."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.start = clock()
+        self.end = None
+        self.captured = 0
+        self.written = 0
+        self.dropped = 0
+        self.write_time = 0.0
+
+    def frame_captured(self):
+        self.captured += 1
+
+    def frame_dropped(self):
+        self.dropped += 1
+
+    def frame_written(self, seconds):
+        """Called from the workers with how long a frame took to downscale and encode."""
+        with self.lock:
+            self.written += 1
+            self.write_time += seconds
+
+    def stop(self):
+        self.end = self.clock()
+
+    def report(self):
+        """Return the sustained rates of the burst as a dict."""
+        elapsed = max((self.end or self.clock()) - self.start, 1e-6)
+        return {
+            "seconds": elapsed,
+            "captured": self.captured,
+            "written": self.written,
+            "dropped": self.dropped,
+            "capture_fps": self.captured / elapsed,
+            "write_fps": self.written / elapsed,
+            "write_ms": self.write_time / self.written * 1000 if self.written else 0.0,
+        }
+
+    def log_report(self, folder):
+        """Log the report and return it."""
+        report = self.report()
+        log_message(f"Burst to {folder}: {report['captured']} frames in {report['seconds']:.1f}s, "
+                    f"captured {report['capture_fps']:.1f} fps, written {report['write_fps']:.1f} fps, "
+                    f"{report['dropped']} dropped, {report['write_ms']:.0f} ms per frame in the workers")
+        return report
@@ -0,0 +1,27 @@
+#!/usr/bin/python
+
+def open_camera(config, camera_num=0):
+    """
+    Open the camera backend set by camera_backend in config.
+
+    'picamera2' (the default) opens the real camera, 'fake' a FakeCamera producing synthetic
+    frames, configured by the fake_camera section, for running the pipeline off a Pi.
+    """
+    backend = config.get('camera_backend', 'picamera2')
+    if backend == 'fake':
+        from .fake_camera import FakeCamera
+        settings = config.get('fake_camera', {})
+        return FakeCamera(camera_num, settings.get('frame_time', 0.0), settings.get('exposure_scale', 0.0), settings.get('full_exposure', 20000))
+    if backend != 'picamera2':
+        raise ValueError(f"Unknown camera backend: {backend}")
+    from picamera2 import Picamera2
+    return Picamera2(camera_num=camera_num)
+
+def get_controls():
+    """Return libcamera.controls, or the fake enums when libcamera is not installed."""
+    try:
+        import libcamera
+        return libcamera.controls
+    except ImportError:
+        from .fake_camera import FakeControls
+        return FakeControls
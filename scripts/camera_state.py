@@ -0,0 +1,94 @@
+#!/usr/bin/python
+import os
+import json
+import threading
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'data')
+
+class CameraState:
+    """
+    Shared store for the camera state (shutter speed, gain, auto exposure offset).
+
+    Readers and writers in the same process share one dict, so the overlay, the interval
+    logic and the capture code never parse the file per frame. The dict is mirrored to a
+    JSON file for the standalone scripts, which run in separate processes. The mirror is
+    written to a temporary file and renamed over the old one, so a reader never sees half
+    a file, and it is only parsed again when its mtime or size changed.
+    """
+
+    def __init__(self, path, mirror=True):
+        self.path = path
+        self.mirror = mirror
+        self.lock = threading.Lock()
+        self.values = {}
+        self.file_key = None
+
+    def stat_key(self):
+        """Return (mtime, size) of the mirror file, or None if it does not exist."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def refresh(self):
+        """Reload the values if another process wrote the mirror file since it was last read."""
+        if not self.mirror:
+            return
+        key = self.stat_key()
+        if key is None or key == self.file_key:
+            return
+        try:
+            with open(self.path, "r") as file:
+                self.values = json.load(file)
+        except (OSError, ValueError):
+            # Keep the last good values, the file is read again when it changes
+            return
+        self.file_key = key
+
+    def get(self, key, default=None):
+        """Return one state value."""
+        with self.lock:
+            self.refresh()
+            return self.values.get(key, default)
+
+    def snapshot(self):
+        """Return a copy of all state values."""
+        with self.lock:
+            self.refresh()
+            return dict(self.values)
+
+    def update(self, **values):
+        """Set state values, the mirror file is only rewritten when something changed."""
+        with self.lock:
+            self.refresh()
+            if all(key in self.values and self.values[key] == value for key, value in values.items()):
+                return
+            self.values.update(values)
+            if self.mirror:
+                self.write()
+
+    def write(self):
+        """Write the mirror file atomically."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.values, file)
+        os.replace(temp_path, self.path)
+        self.file_key = self.stat_key()
+
+def get_state_file(camera_num=0):
+    """Return the mirror file of a camera, camera 0 keeps the original camera_state.json."""
+    name = 'camera_state.json' if camera_num == 0 else f'camera_state_{camera_num}.json'
+    return os.path.join(DATA_DIR, name)
+
+_camera_states = {}
+_camera_states_lock = threading.Lock()
+
+def get_camera_state(camera_num=0):
+    """Return the state of a camera, shared by everything in this process."""
+    with _camera_states_lock:
+        if camera_num not in _camera_states:
+            # Creating the store does not touch the file, it is read on first use
+            _camera_states[camera_num] = CameraState(get_state_file(camera_num))
+        return _camera_states[camera_num]
@@ -1,10 +1,10 @@
 #!/usr/bin/python
 import requests
 import subprocess
-import yaml
 import os
 import logging
 from datetime import datetime, timedelta
+from config import load_config
 
 # Dynamically find the project root directory
 project_root_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -18,9 +18,7 @@ logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s -
 #logging.info(f"Logging to {log_file}")
 
 # Load configuration
-config_path = os.path.join(project_root_dir, 'config.yaml')
-with open(config_path, 'r') as file:
-    config = yaml.safe_load(file)
+config = load_config(sections=('remote',))
 
 # Check if logging is enabled in config
 log_check_upload = config.get('log_check_upload', False)
@@ -0,0 +1,303 @@
+#!/usr/bin/python
+import os
+import struct
+import ctypes
+import ctypes.util
+import threading
+import yaml
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'config.yaml')
+
+NUMBER = (int, float)
+PAIR = 'pair'
+
+# Sections of (key, expected type, required), nested keys are dotted. Optional keys may also be
+# empty. Each script checks only the sections it reads, a key may be listed in several.
+SCHEMA = {
+    'camera': [
+        ('camera_name', str, True),
+        ('main_size', PAIR, True),
+        ('lores_size', PAIR, True),
+        ('display', (str, type(None)), True),
+        ('awb_enable', bool, True),
+        ('awb_mode', str, True),
+        ('colour_gains', PAIR, True),
+        ('colour_gains_night', PAIR, True),
+        ('interval', NUMBER, True),
+        ('status_file', (str, bool, type(None)), True),
+        ('test_file', str, True),
+        ('focus_mode', str, True),
+        ('lens_position', NUMBER, True),
+        ('hdr', bool, True),
+        ('crop_image', bool, False),
+        ('crop_size', PAIR, False),
+        ('persistent_camera', bool, False),
+        ('in_memory_pipeline', bool, False),
+        ('day_night_switching', bool, False),
+        ('camera_backend', str, False),
+        ('cameras', list, False),
+        ('hdr_device', str, False),
+        ('camera_constants.DAYTIME_SHUTTER', NUMBER, True),
+        ('camera_constants.DAYTIME_GAIN', NUMBER, True),
+        ('camera_constants.MAX_SHUTTER', NUMBER, True),
+        ('camera_constants.MAX_GAIN', NUMBER, True),
+        ('camera_constants.SUNRISE_OFFSET_MINUTES', NUMBER, True),
+        ('camera_constants.POST_SUNSET_DELAY_MINUTES', NUMBER, True),
+        ('camera_constants.DAY_ELEVATION', NUMBER, False),
+        ('camera_constants.NIGHT_ELEVATION', NUMBER, False),
+        ('schedule.align_to_clock', bool, False),
+        ('schedule.late_policy', str, False),
+        ('settle.timeout', NUMBER, False),
+        ('settle.tolerance', NUMBER, False),
+        ('frame_queue.workers', int, False),
+        ('frame_queue.max_pending', int, False),
+        ('adaptive_interval.min_interval', NUMBER, False),
+        ('adaptive_interval.max_interval', NUMBER, False),
+        ('change_detection.threshold', NUMBER, False),
+        ('night_stacking.method', str, False),
+        ('auto_exposure.metering', str, False),
+        ('auto_exposure.target', NUMBER, False),
+        ('burst.fps', NUMBER, False),
+        ('burst.size', PAIR, False),
+        ('burst.output_size', PAIR, False),
+        ('staging.folder', str, False),
+        ('staging.batch_size', int, False),
+        ('staging.max_age', NUMBER, False),
+        ('staging.fsync', str, False),
+    ],
+    'location': [
+        ('location.latitude', NUMBER, True),
+        ('location.longitude', NUMBER, True),
+    ],
+    'overlay': [
+        ('camera_name', str, True),
+        ('overlay.enabled', bool, True),
+        ('overlay.mode', str, False),
+        ('overlay.status_overlay', bool, False),
+        ('overlay.record_values', bool, False),
+        ('weather.refresh_interval', NUMBER, False),
+        ('weather.timeout', NUMBER, False),
+        ('weather.budget', NUMBER, False),
+        ('weather.max_age', NUMBER, False),
+        ('system_metrics.enabled', bool, False),
+        ('system_metrics.interval', NUMBER, False),
+        ('system_metrics.history', int, False),
+        ('system_metrics.mirror_file', str, False),
+        ('system_metrics.persist', bool, False),
+        ('system_metrics.sparklines', bool, False),
+        ('system_metrics.sparkline_points', int, False),
+    ],
+    'images': [
+        ('image_quality', int, True),
+        ('image_output.root_folder', str, True),
+        ('image_output.test_folder', str, True),
+        ('image_output.folder_structure', str, True),
+        ('image_output.filename_prefix', str, True),
+    ],
+    'video': [
+        ('main_size', PAIR, True),
+        ('video_output.root_folder', str, True),
+        ('video_output.folder_structure', str, True),
+        ('video_output.filename_prefix', str, True),
+        ('video_output.video_width', int, True),
+        ('video_output.video_height', int, True),
+        ('video_output.framerate', NUMBER, True),
+        ('video_output.bitrate', (int, str), True),
+        ('video_output.video_format', str, True),
+        ('video_output.constant_rate_factor', int, True),
+        ('video_output.codec', str, False),
+        ('video_output.overlay_workers', int, False),
+        ('video_upload.enabled', bool, False),
+    ],
+    'upload': [
+        ('camera_id', (int, str), True),
+        ('video_upload.url', str, True),
+        ('video_upload.api_key', str, True),
+    ],
+    'remote': [
+        ('camera_id', (int, str), True),
+        ('remote.url', str, True),
+        ('remote.token', str, True),
+    ],
+}
+
+# What the capture scripts and timelapse.py read, location is checked where the sun times are needed
+CAPTURE_SECTIONS = ('camera', 'overlay', 'images')
+
+CHOICES = {
+    'focus_mode': ('manual', 'auto'),
+    'awb_mode': ('Auto', 'Incandescent', 'Tungsten', 'Fluorescent', 'Indoor', 'Daylight', 'Cloudy', 'Custom'),
+    'camera_backend': ('picamera2', 'fake'),
+    'schedule.late_policy': ('skip', 'coalesce'),
+    'night_stacking.method': ('mean', 'median'),
+    'auto_exposure.metering': ('mean', 'percentile'),
+    'staging.fsync': ('file', 'batch', 'none'),
+    'overlay.mode': ('burn', 'sidecar'),
+}
+
+class ConfigError(Exception):
+    """The config file could not be read or does not match the schema."""
+
+def lookup(config, key):
+    """Return (found, value) for a dotted key."""
+    value = config
+    for part in key.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+def type_names(expected):
+    if expected == PAIR:
+        return 'a pair of numbers'
+    return ' or '.join(t.__name__ for t in (expected if isinstance(expected, tuple) else (expected,)))
+
+def check_type(value, expected):
+    if expected == PAIR:
+        return isinstance(value, (list, tuple)) and len(value) == 2 and all(check_type(v, NUMBER) for v in value)
+    types = expected if isinstance(expected, tuple) else (expected,)
+    # YAML true/false would pass as int
+    if isinstance(value, bool) and bool not in types:
+        return False
+    return isinstance(value, types)
+
+def get_schema(sections):
+    """Return {key: (expected type, required)} for the given SCHEMA sections."""
+    schema = {}
+    for section in sections:
+        for key, expected, required in SCHEMA[section]:
+            required = required or schema.get(key, (None, False))[1]
+            schema[key] = (expected, required)
+    return schema
+
+def validate_config(config, sections=CAPTURE_SECTIONS):
+    """Return a list of problems with the config for the given SCHEMA sections, empty if it is valid."""
+    if not isinstance(config, dict):
+        return ["The config must be a mapping of keys to values"]
+    problems = []
+    for key, (expected, required) in get_schema(sections).items():
+        found, value = lookup(config, key)
+        if not found:
+            if required:
+                problems.append(f"{key} is missing")
+            continue
+        if value is None and not required:
+            continue
+        if not check_type(value, expected):
+            problems.append(f"{key} should be {type_names(expected)}, got {value!r}")
+    for key, choices in CHOICES.items():
+        found, value = lookup(config, key)
+        if found and value is not None and value not in choices:
+            problems.append(f"{key} should be one of {', '.join(choices)}, got {value!r}")
+    return problems
+
+def file_key(path):
+    """Return (mtime, size) of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def load_config(path=CONFIG_PATH, sections=CAPTURE_SECTIONS):
+    """
+    Load and validate a config file.
+
+    The result is cached until the file's mtime or size changes, so calling this for every
+    frame costs one stat. The returned dict is shared, callers must not modify it.
+    :param sections: The SCHEMA sections the caller reads, other keys are not checked.
+    :raises ConfigError: if the file is missing, not valid YAML or does not match the schema.
+    """
+    path = os.path.realpath(path)
+    sections = tuple(sections)
+    key = file_key(path)
+    if key is None:
+        raise ConfigError(f"Config file {path} not found")
+    with _cache_lock:
+        cached = _cache.get((path, sections))
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+    try:
+        with open(path, 'r') as config_file:
+            config = yaml.safe_load(config_file)
+    except yaml.YAMLError as e:
+        raise ConfigError(f"Config file {path} is not valid YAML: {e}")
+
+    problems = validate_config(config, sections)
+    if problems:
+        raise ConfigError(f"Config file {path} is invalid:\n  " + "\n  ".join(problems))
+
+    with _cache_lock:
+        _cache[(path, sections)] = (key, config)
+    return config
+
+# inotify flags, from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')
+
+def inotify_watch(folder, mask):
+    """Open a non-blocking inotify descriptor watching a folder."""
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    if libc.inotify_add_watch(fd, os.fsencode(folder), mask) < 0:
+        errno = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(errno, f"inotify_add_watch failed for {folder}")
+    return fd
+
+class ConfigWatcher:
+    """
+    Tell a long-running process when the config file has been edited.
+
+    The folder is watched with inotify, since editors often write a new file and rename it
+    over the old one. Without inotify the mtime is compared on every check instead.
+    """
+
+    def __init__(self, path=CONFIG_PATH):
+        self.path = os.path.realpath(path)
+        self.name = os.fsencode(os.path.basename(self.path))
+        self.key = file_key(self.path)
+        try:
+            self.fd = inotify_watch(os.path.dirname(self.path), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        except (OSError, AttributeError, TypeError):
+            self.fd = None
+
+    def events(self):
+        """Return True if inotify reported a write to the config file since the last call."""
+        touched = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return touched
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                touched = touched or name == self.name
+                offset += EVENT_HEADER.size + length
+
+    def changed(self):
+        """Return True once for each change of the config file."""
+        if self.fd is not None and not self.events():
+            return False
+        key = file_key(self.path)
+        if key is None or key == self.key:
+            return False
+        self.key = key
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+import datetime
+import functools
+import numpy as np
+from .solar import solar_elevation, get_location
+
+MINUTES_PER_DAY = 24 * 60
+
+def split_exposure(exposure, day_shutter, day_gain, max_shutter, max_gain):
+    """Split an exposure (shutter speed x gain) into shutter speed and gain, lengthening the shutter speed first."""
+    shutter = np.clip(exposure / day_gain, day_shutter, max_shutter)
+    gain = np.clip(exposure / shutter, day_gain, max_gain)
+    return shutter, gain
+
+def plan_settings(config):
+    """Return the config values the exposure plan depends on, as a hashable tuple."""
+    constants = config['camera_constants']
+    latitude, longitude = get_location(config)
+    return (
+        latitude, longitude,
+        constants['DAYTIME_SHUTTER'], constants['DAYTIME_GAIN'],
+        constants['MAX_SHUTTER'], constants['MAX_GAIN'],
+        constants.get('DAY_ELEVATION', 0.0), constants.get('NIGHT_ELEVATION', -12.0),
+        tuple(config['colour_gains']), tuple(config['colour_gains_night']),
+    )
+
+@functools.lru_cache(maxsize=4)
+def build_exposure_plan(date, settings):
+    """
+    Compute the shutter speed, gain and colour gains for every minute of a day.
+
+    The exposure (shutter speed x gain) is interpolated in stops between the day values at
+    DAY_ELEVATION and the max values at NIGHT_ELEVATION of the sun. The shutter speed is
+    lengthened first and the gain only raised once the shutter speed is at its max. The
+    colour gains follow the same curve from the day to the night values.
+    :return: Dict of numpy arrays with one entry per minute of local time.
+    """
+    (latitude, longitude, day_shutter, day_gain, max_shutter, max_gain,
+     day_elevation, night_elevation, day_colour_gains, night_colour_gains) = settings
+
+    midnight = datetime.datetime(date.year, date.month, date.day).timestamp()
+    timestamps = midnight + np.arange(MINUTES_PER_DAY) * 60.0
+    elevation = solar_elevation(timestamps, latitude, longitude)
+
+    # 0 in daylight, 1 at night
+    night_fraction = np.clip((day_elevation - elevation) / (day_elevation - night_elevation), 0.0, 1.0)
+
+    day_ev = np.log2(day_shutter * day_gain)
+    night_ev = np.log2(max_shutter * max_gain)
+    exposure = np.exp2(day_ev + night_fraction * (night_ev - day_ev))
+
+    shutter, gain = split_exposure(exposure, day_shutter, day_gain, max_shutter, max_gain)
+    colour_gains = np.asarray(day_colour_gains) + night_fraction[:, np.newaxis] * (np.asarray(night_colour_gains) - np.asarray(day_colour_gains))
+
+    return {
+        "elevation": elevation,
+        "night_fraction": night_fraction,
+        "shutter_speed": shutter.astype(np.int64),
+        "gain": np.round(gain, 2),
+        "colour_gains": np.round(colour_gains, 3),
+    }
+
+def get_planned_exposure(config, now=None):
+    """
+    Look up the planned exposure for a time, the plan is only computed once per day.
+
+    :return: Tuple of (shutter speed, gain, colour gains).
+    """
+    now = now or datetime.datetime.now()
+    plan = build_exposure_plan(now.date(), plan_settings(config))
+    minute = now.hour * 60 + now.minute
+    return int(plan["shutter_speed"][minute]), float(plan["gain"][minute]), tuple(float(g) for g in plan["colour_gains"][minute])
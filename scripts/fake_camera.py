@@ -0,0 +1,179 @@
+#!/usr/bin/python
+import enum
+import time
+import threading
+import numpy as np
+from PIL import Image
+
+class AfModeEnum(enum.IntEnum):
+    Manual = 0
+    Auto = 1
+    Continuous = 2
+
+class AfStateEnum(enum.IntEnum):
+    Idle = 0
+    Scanning = 1
+    Focused = 2
+    Failed = 3
+
+class AwbModeEnum(enum.IntEnum):
+    Auto = 0
+    Incandescent = 1
+    Tungsten = 2
+    Fluorescent = 3
+    Indoor = 4
+    Daylight = 5
+    Cloudy = 6
+    Custom = 7
+
+class FakeControls:
+    """Stands in for libcamera.controls with the enums the capture scripts use."""
+    AfModeEnum = AfModeEnum
+    AfStateEnum = AfStateEnum
+    AwbModeEnum = AwbModeEnum
+
+# Exposure the fake automatic exposure settles on
+AUTO_EXPOSURE_TIME = 10000
+
+class FakeRequest:
+    """A completed request holding one synthetic frame of each stream."""
+
+    def __init__(self, camera, index, metadata):
+        self.camera = camera
+        self.index = index
+        self.metadata = metadata
+
+    def make_array(self, name):
+        return self.camera.render(name, self.index, self.metadata)
+
+    def make_image(self, name):
+        return Image.fromarray(self.make_array(name))
+
+    def get_metadata(self):
+        return dict(self.metadata)
+
+    def save(self, name, file_output):
+        self.make_image(name).save(file_output, quality=self.camera.options.get('quality', 90))
+
+    def release(self):
+        pass
+
+class FakeCamera:
+    """
+    Drop-in for the parts of Picamera2 this repo uses, producing synthetic frames.
+
+    The main stream is an RGB gradient and the lores stream a YUV420 buffer, both with a
+    square moving across so change detection sees motion. Brightness follows the exposure:
+    ExposureTime x AnalogueGain / full_exposure of full scale. Each frame takes frame_time
+    plus exposure_scale times the exposure time, so long exposures can be simulated faster
+    than real time.
+    """
+
+    def __init__(self, camera_num=0, frame_time=0.0, exposure_scale=0.0, full_exposure=20000):
+        self.camera_num = camera_num
+        self.frame_time = frame_time
+        self.exposure_scale = exposure_scale
+        self.full_exposure = full_exposure
+        self.camera_properties = {'Model': 'fake', 'Location': camera_num}
+        self.options = {}
+        self.camera_config = None
+        self.controls = {}
+        self.started = False
+        self.frames = 0
+        self.lock = threading.Lock()
+        self.patterns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.stop()
+
+    def create_still_configuration(self, main=None, lores=None, display=None, controls=None, buffer_count=1):
+        config = {'main': dict(main or {'size': (4056, 3040)}), 'display': display, 'controls': dict(controls or {}), 'buffer_count': buffer_count}
+        if lores is not None:
+            config['lores'] = dict(lores)
+        return config
+
+    def create_video_configuration(self, main=None, lores=None, display=None, controls=None, buffer_count=6):
+        return self.create_still_configuration(main or {'size': (1280, 720)}, lores, display, controls, buffer_count)
+
+    def configure(self, camera_config):
+        self.camera_config = camera_config
+        self.controls = dict(camera_config.get('controls', {}))
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.started = False
+
+    def set_controls(self, controls):
+        self.controls.update(controls)
+
+    def next_metadata(self):
+        """Wait for the next frame and return its metadata."""
+        exposure_time = self.controls.get('ExposureTime') or AUTO_EXPOSURE_TIME
+        gain = self.controls.get('AnalogueGain') or 1.0
+        time.sleep(self.frame_time + exposure_time / 1000000 * self.exposure_scale)
+        with self.lock:
+            self.frames += 1
+        metadata = {
+            'ExposureTime': int(exposure_time),
+            'AnalogueGain': float(gain),
+            'DigitalGain': 1.0,
+            'AeLocked': True,
+            'AfState': AfStateEnum.Focused if self.controls.get('AfMode') == AfModeEnum.Auto else AfStateEnum.Idle,
+            'SensorTimestamp': time.monotonic_ns(),
+        }
+        for key in ('LensPosition', 'ColourGains'):
+            if self.controls.get(key) is not None:
+                metadata[key] = self.controls[key]
+        return metadata
+
+    def capture_metadata(self):
+        return self.next_metadata()
+
+    def capture_request(self):
+        if not self.started:
+            raise RuntimeError("Camera must be started before capturing")
+        metadata = self.next_metadata()
+        return FakeRequest(self, self.frames, metadata)
+
+    def capture_file(self, file_name):
+        request = self.capture_request()
+        request.save('main', file_name)
+        return request.get_metadata()
+
+    def capture_array(self, name='main'):
+        return self.capture_request().make_array(name)
+
+    def pattern(self, width, height):
+        """Return the gradient for a stream size, built once per size."""
+        if (width, height) not in self.patterns:
+            x = np.linspace(0, 255, width, dtype=np.float32)
+            y = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+            rgb = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)), (x + y) / 2], axis=2)
+            self.patterns[(width, height)] = rgb.astype(np.uint8)
+        return self.patterns[(width, height)]
+
+    def render(self, name, index, metadata):
+        """Render the frame of a stream for a request."""
+        width, height = self.camera_config[name]['size']
+        brightness = min(metadata['ExposureTime'] * metadata['AnalogueGain'] / self.full_exposure, 1.0)
+        frame = (self.pattern(width, height) * brightness).astype(np.uint8)
+
+        # A moving square, one step per frame
+        size = max(height // 8, 1)
+        left = (index * size // 2) % max(width - size, 1)
+        frame[height // 2 - size // 2:height // 2 + size // 2, left:left + size] = 255
+
+        if name == 'lores':
+            # YUV420 layout: the Y plane followed by the quarter size U and V planes
+            luma = frame.mean(axis=2).astype(np.uint8)
+            chroma = np.full((height // 2, width), 128, dtype=np.uint8)
+            return np.concatenate([luma, chroma])
+        return frame
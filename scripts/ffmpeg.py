@@ -2,8 +2,12 @@
 import subprocess
 import os
 import time
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from colored import fg, attr
 from .logger import log_message
+from .overlay_metadata import load_overlay_records
 
 
 def format_duration(duration):
@@ -11,25 +15,136 @@ def format_duration(duration):
     seconds = int(duration % 60)
     return f"{minutes} minutes, {seconds} seconds"
 
+def get_image_paths(config, image_files):
+    """Return the full paths of the image files, which may be spread over the folders of two days."""
+    image_paths = []
+    for image_file in image_files:
+        # Extract date part from filename by splitting on underscores
+        filename_parts = image_file.split('_')
+
+        # Ensure we have enough parts and the expected format
+        if len(filename_parts) >= 6:
+            date_part = filename_parts[2:5]  # ['2024', '09', '23'] expected for the date
+            correct_folder = os.path.join(config['image_output']['root_folder'], *date_part)
+        else:
+            # Handle cases where filename does not match the expected format
+            log_message(f"Invalid filename format: {image_file}")
+            continue
+
+        image_paths.append(os.path.join(correct_folder, image_file))
+    return image_paths
+
+def compose_frame(config, image_path, values, size):
+    """
+    Decode a frame for the video and draw the overlay band from its recorded values on it.
+
+    The JPEG is decoded at a reduced scale when the video is smaller. The band is rendered at
+    the full frame width, like on the camera, and scaled with the frame. Frames without
+    recorded values, or with the band already burned in, are used as they are.
+    :return: The frame as raw RGB bytes of the video size.
+    """
+    from PIL import Image
+    from overlay import render_values_band, get_crop_dimensions, BAND_HEIGHT, IMAGE_OFFSET
+
+    with Image.open(image_path) as img:
+        full_width = img.width
+        img.draft('RGB', size)
+        img = img.convert('RGB')
+
+    if values is not None and not values.get('burned', False):
+        scale = img.width / full_width
+        crop_dimensions = get_crop_dimensions(config)
+        if crop_dimensions:
+            full_width, full_height = config['main_size']
+            img = img.crop(tuple(round(v * scale) for v in crop_dimensions)).resize((round(full_width * scale), round(full_height * scale)))
+
+        band = render_values_band(values, full_width)
+        if img.width != full_width:
+            band = band.resize((img.width, round(BAND_HEIGHT * scale)))
+        offset = round(IMAGE_OFFSET * scale)
+        frame = Image.new('RGB', (img.width, img.height + offset), None)
+        frame.paste(img, (0, offset))
+        frame.paste(band, (0, 0))
+        img = frame
+    return img.resize(size).tobytes()
+
+def sidecar_frames(config, image_paths, size, workers=4):
+    """Yield the frames for the video in order, composed on a pool of threads that stays a few frames ahead."""
+    records = {}
+
+    def get_values(image_path):
+        folder = os.path.dirname(image_path)
+        if folder not in records:
+            records[folder] = load_overlay_records(folder)
+        return records[folder].get(os.path.basename(image_path))
+
+    def take(pending):
+        image_path, future = pending.popleft()
+        try:
+            return future.result()
+        except Exception as e:
+            log_message(f"Skipping {image_path}: {e}")
+            return None
+
+    pending = deque()
+    with ThreadPoolExecutor(workers) as executor:
+        for image_path in image_paths:
+            pending.append((image_path, executor.submit(compose_frame, config, image_path, get_values(image_path), size)))
+            if len(pending) >= workers * 2:
+                frame = take(pending)
+                if frame is not None:
+                    yield frame
+        while pending:
+            frame = take(pending)
+            if frame is not None:
+                yield frame
+
+def run_with_frames(command, frames):
+    """Run ffmpeg with the frames written to its stdin, returns the completed process."""
+    # ffmpeg's log goes to a file, a full stderr pipe would block it while we write frames
+    with tempfile.TemporaryFile() as log_file:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=log_file)
+        try:
+            for frame in frames:
+                process.stdin.write(frame)
+        except BrokenPipeError:
+            # ffmpeg exited early, its log tells why
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+        process.wait()
+        log_file.seek(0)
+        return subprocess.CompletedProcess(command, process.returncode, stderr=log_file.read().decode(errors='replace'))
+
 def ffmpeg_command(image_folder, video_path, config, image_files):
-    # Generate the list of image files for FFmpeg
-    list_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'data', 'ffmpeg_list.txt')
-    
-    with open(list_path, 'w') as f:
-        for image_file in image_files:
-            # Extract date part from filename by splitting on underscores
-            filename_parts = image_file.split('_')
-            
-            # Ensure we have enough parts and the expected format
-            if len(filename_parts) >= 6:
-                date_part = filename_parts[2:5]  # ['2024', '09', '23'] expected for the date
-                correct_folder = os.path.join(config['image_output']['root_folder'], *date_part)
-            else:
-                # Handle cases where filename does not match the expected format
-                log_message(f"Invalid filename format: {image_file}")
-                continue
-            
-            f.write(f"file '{os.path.join(correct_folder, image_file)}'\n")
+    image_paths = get_image_paths(config, image_files)
+    video_size = (config['video_output']['video_width'], config['video_output']['video_height'])
+    # In sidecar mode the frames are stored without overlay, it is drawn here from the recorded values
+    sidecar = config['overlay'].get('mode', 'burn') == 'sidecar'
+
+    if sidecar:
+        input_settings = [
+            ('-f', 'rawvideo'),
+            ('-pix_fmt', 'rgb24'),
+            ('-s', f"{video_size[0]}x{video_size[1]}"),
+            ('-framerate', str(config['video_output']['framerate'])),
+            ('-i', '-'),
+        ]
+    else:
+        # Generate the list of image files for FFmpeg
+        list_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'data', 'ffmpeg_list.txt')
+        with open(list_path, 'w') as f:
+            for image_path in image_paths:
+                f.write(f"file '{image_path}'\n")
+        input_settings = [
+            ('-f', 'concat'),
+            ('-safe', '0'),
+            ('-i', list_path),
+            ('-framerate', str(config['video_output']['framerate'])),
+        ]
 
     # Use 'h264_v4l2m2m' if specified in the config, otherwise default to 'libx264'
     codec = config['video_output'].get('codec', 'libx264') or 'libx264'
@@ -39,10 +154,7 @@ def ffmpeg_command(image_folder, video_path, config, image_files):
     
     ffmpeg_settings = [
         ('-y', None),  # Overwrite the output file without asking for confirmation
-        ('-f', 'concat'),
-        ('-safe', '0'),
-        ('-i', list_path),
-        ('-framerate', str(config['video_output']['framerate'])),
+        *input_settings,
         ('-s', f"{config['video_output']['video_width']}x{config['video_output']['video_height']}"),
         ('-vf', f"deflicker,setpts=N/FRAME_RATE/TB"),
         ('-c:v', codec),  # Use the codec from config or default to 'libx264'
@@ -69,7 +181,10 @@ def ffmpeg_command(image_folder, video_path, config, image_files):
 
     start_time = time.time()
     # output = subprocess.run(ffmpeg_command)
-    output = subprocess.run(ffmpeg_command, stderr=subprocess.PIPE, text=True)
+    if sidecar:
+        output = run_with_frames(ffmpeg_command, sidecar_frames(config, image_paths, video_size, config['video_output'].get('overlay_workers', 4)))
+    else:
+        output = subprocess.run(ffmpeg_command, stderr=subprocess.PIPE, text=True)
     if output.returncode != 0:
         print("FFmpeg Error:", output.stderr)
 
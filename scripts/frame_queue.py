@@ -0,0 +1,61 @@
+#!/usr/bin/python
+import time
+import queue
+import threading
+from .logger import log_message
+
+class FrameQueue:
+    """
+    Encode, overlay and publish captured frames on background threads.
+
+    The queue is bounded: when the workers fall behind, submit() blocks until there is room,
+    so the capture loop slows down instead of holding more and more 4K buffers in memory.
+    """
+
+    def __init__(self, workers=1, max_pending=2):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.threads = [threading.Thread(target=self.run, name=f"frame-queue-{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, func, *args):
+        """Queue func(*args) for a worker and return how long the caller was held back."""
+        start = time.monotonic()
+        self.queue.put((func, args))
+        waited = time.monotonic() - start
+        if waited > 0.1:
+            log_message(f"Frame queue full, capture waited {waited:.1f}s")
+        return waited
+
+    def try_submit(self, func, *args):
+        """Queue func(*args) if there is room right now, returns False if the queue is full."""
+        try:
+            self.queue.put_nowait((func, args))
+        except queue.Full:
+            return False
+        return True
+
+    def run(self):
+        """Worker loop, runs jobs until a None sentinel is received."""
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                func, args = job
+                func(*args)
+            except Exception as e:
+                log_message(f"Frame job failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        """Wait until all queued frames have been written."""
+        self.queue.join()
+
+    def close(self):
+        """Finish the queued frames and stop the workers."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+import os
+import sys
+import time
+import resource
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+# Allow running as python scripts/load_test.py from the project folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts.stage_timer import enable_stage_timing
+from scripts.multi_camera import merge_config
+from scripts.config import load_config
+from scripts.logger import set_log_folder
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Run the capture pipeline on the fake camera and report its throughput.")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'example_config.yaml'), help="Config to start from.")
+    parser.add_argument("--frames", type=int, default=50, help="Number of frames to capture.")
+    parser.add_argument("--mode", choices=['day', 'night'], default='day', help="Capture with day or night settings.")
+    parser.add_argument("--frame-time", type=float, default=0.0, help="Seconds the fake camera takes per frame.")
+    parser.add_argument("--size", type=int, nargs=2, help="Main stream size, defaults to main_size of the config.")
+    parser.add_argument("--no-overlay", action="store_true", help="Skip the overlay.")
+    parser.add_argument("--queue", action="store_true", help="Hand frames to the frame queue.")
+    parser.add_argument("--workers", type=int, default=2, help="Frame queue workers.")
+    parser.add_argument("--staging", action="store_true", help="Finish frames in a staging folder and flush them in batches.")
+    parser.add_argument("--output", help="Folder for the frames, a temporary folder by default.")
+    return parser.parse_args()
+
+def build_test_config(config, args, output):
+    """Point the config at the fake camera and keep every file the pipeline writes inside output."""
+    overrides = {
+        'camera_backend': 'fake',
+        'fake_camera': {'frame_time': args.frame_time, 'exposure_scale': 0.0},
+        'persistent_camera': True,
+        'status_file': os.path.join(output, 'status.jpg'),
+        'test_file': os.path.join(output, 'test.jpg'),
+        'image_output': {'root_folder': os.path.join(output, 'images'), 'test_folder': output},
+        'overlay': {'enabled': not args.no_overlay},
+        'staging': {'enabled': args.staging, 'folder': os.path.join(output, 'staging')},
+        'frame_queue': {'enabled': args.queue, 'workers': args.workers, 'max_pending': args.workers * 2},
+    }
+    if args.size:
+        overrides['main_size'] = list(args.size)
+    return merge_config(config, overrides)
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (ru_maxrss is in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run(config, frames, mode):
+    """
+    Capture frames through the camera service.
+
+    Frames come faster than one per second, which file names can not tell apart, so each
+    one is named after its own second counting from the start of the run.
+    :return: Tuple of (seconds it took until all were written, paths of the stored frames).
+    """
+    from timelapse import create_frame_queue, capture_night_frame
+    from capture_service import CameraService
+    from scripts.camera_state import get_camera_state
+    from scripts.staging import flush_staging
+
+    # Leave the state file of the real timelapse alone
+    get_camera_state(config.get('camera_num', 0)).mirror = False
+    frame_queue = create_frame_queue(config)
+    first_frame = datetime.now().replace(microsecond=0)
+    stored = []
+    start = time.perf_counter()
+    with CameraService(config, frame_queue=frame_queue) as service:
+        for index in range(frames):
+            now = first_frame + timedelta(seconds=index)
+            if mode == 'day':
+                path = service.capture_day(now)
+            else:
+                path = capture_night_frame(config, service, transition=False, now=now)
+            if path is not None:
+                stored.append(path)
+        if frame_queue is not None:
+            frame_queue.join()
+    flush_staging(config, force=True)
+    return time.perf_counter() - start, stored
+
+def print_report(frames, seconds, timer):
+    print(f"{frames} frames in {seconds:.2f}s: {frames / seconds:.2f} frames/s, peak RSS {peak_rss_mb():.0f} MB")
+    print(f"{'stage':<10} {'count':>6} {'mean ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for stage, stats in timer.summary().items():
+        print(f"{stage:<10} {stats['count']:>6} {stats['mean']:>9.1f} {stats['p95']:>9.1f} {stats['max']:>9.1f}")
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    output = args.output or tempfile.mkdtemp(prefix='timelapse-load-test-')
+    config = build_test_config(load_config(args.config), args, output)
+
+    # Keep timelapse.log with the frames as well
+    set_log_folder(os.path.join(output, 'logs'))
+
+    timer = enable_stage_timing()
+    seconds, stored = run(config, args.frames, args.mode)
+    print_report(args.frames, seconds, timer)
+    print(f"Frames written to {output}")
+
+    # Every stored frame must have ended up on disk, otherwise the numbers above are meaningless
+    missing = [path for path in stored if not os.path.isfile(path)]
+    if missing:
+        sys.exit(f"{len(missing)} of {len(stored)} stored frames are missing, e.g. {missing[0]}")
+    print(f"{len(stored)} frames stored, {args.frames - len(stored)} skipped")
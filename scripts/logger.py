@@ -3,11 +3,16 @@ import os
 import time
 from colored import fg, attr
 
+LOG_FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'logs')
+
+def set_log_folder(folder):
+    """Write timelapse.log to another folder, e.g. to keep test runs out of the project."""
+    global LOG_FOLDER
+    LOG_FOLDER = folder
+
 def log_message(*messages):
-    script_path = os.path.dirname(os.path.realpath(__file__))
-    log_path = os.path.join(script_path, '..', 'logs', 'timelapse.log')
-    log_dir = os.path.dirname(log_path)
-    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(LOG_FOLDER, 'timelapse.log')
+    os.makedirs(LOG_FOLDER, exist_ok=True)
 
     timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
     log_line = f"[{timestamp}] {attr('reset')}{' '.join(map(str, messages))}\n"
@@ -0,0 +1,35 @@
+#!/usr/bin/python
+import copy
+
+def merge_config(base, override):
+    """Return a copy of base with the values of override on top, nested sections are merged key by key."""
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+def get_camera_configs(config):
+    """
+    Return one full config per camera.
+
+    Each entry of the cameras list only holds what differs for that camera (camera_num,
+    camera_name, image_output, status_file, interval, ...) and is merged onto the rest of
+    the config. Without a cameras list this is the config itself, for camera 0.
+    """
+    cameras = config.get('cameras') or [{}]
+    configs = []
+    for index, camera in enumerate(cameras):
+        camera_config = merge_config({key: value for key, value in config.items() if key != 'cameras'}, camera)
+        camera_config.setdefault('camera_num', index)
+        configs.append(camera_config)
+
+    camera_nums = [camera_config['camera_num'] for camera_config in configs]
+    if len(set(camera_nums)) != len(camera_nums):
+        raise ValueError(f"Each camera needs its own camera_num: {camera_nums}")
+    roots = [camera_config['image_output']['root_folder'] for camera_config in configs]
+    if len(set(roots)) != len(roots):
+        raise ValueError("Each camera needs its own image_output.root_folder")
+    return configs
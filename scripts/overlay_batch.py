@@ -0,0 +1,185 @@
+#!/usr/bin/python
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image
+
+# Allow running as python scripts/overlay_batch.py from the project folder
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+from scripts.config import load_config, CONFIG_PATH
+from scripts.overlay_metadata import load_overlay_records
+
+def parse_time(value):
+    """Parse 'YYYY-MM-DD', 'YYYY-MM-DD HH:MM' or 'YYYY-MM-DD HH:MM:SS'."""
+    for time_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"Invalid time {value!r}, use YYYY-MM-DD or 'YYYY-MM-DD HH:MM'")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Render the overlay again on stored frames, from the values recorded when they were captured.")
+    parser.add_argument("--config", default=CONFIG_PATH, help="Config file.")
+    parser.add_argument("--date", type=parse_time, help="Render all frames of this day.")
+    parser.add_argument("--start", type=parse_time, help="Render frames from this time.")
+    parser.add_argument("--end", type=parse_time, help="Render frames up to this time, defaults to the end of the start day.")
+    parser.add_argument("--output", help="Folder for the rendered frames, with the same folder structure. Frames with the overlay burned in are replaced in place by default.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes.")
+    parser.add_argument("--max-pending", type=int, help="Frames queued for the workers at most, defaults to twice the workers.")
+    parser.add_argument("--restart", action="store_true", help="Render frames a previous run of the same range already finished again.")
+    args = parser.parse_args()
+
+    if args.date:
+        args.start = args.date
+        args.end = args.date + timedelta(days=1, seconds=-1)
+    if args.start is None:
+        parser.error("Give --date or --start")
+    args.end = args.end or args.start.replace(hour=23, minute=59, second=59)
+    return args
+
+def get_frame_time(config, file_name):
+    """Return the capture time from a frame's file name, or None if it is not a frame."""
+    prefix = config['image_output']['filename_prefix']
+    if not file_name.startswith(prefix) or not file_name.endswith('.jpg'):
+        return None
+    try:
+        return datetime.strptime(file_name[len(prefix):-len('.jpg')], '%Y_%m_%d_%H_%M_%S')
+    except ValueError:
+        return None
+
+def find_frames(config, start, end):
+    """
+    Return the frames between start and end in capture order.
+
+    :return: Tuple of ([(path, recorded values)], number of frames without recorded values).
+    """
+    frames = []
+    missing = 0
+    day = start.date()
+    while day <= end.date():
+        folder = os.path.join(config['image_output']['root_folder'], day.strftime(config['image_output']['folder_structure']))
+        records = load_overlay_records(folder)
+        names = os.listdir(folder) if os.path.isdir(folder) else []
+        for name in sorted(names):
+            frame_time = get_frame_time(config, name)
+            if frame_time is None or not start <= frame_time <= end:
+                continue
+            if name in records:
+                frames.append((os.path.join(folder, name), records[name]))
+            else:
+                missing += 1
+        day += timedelta(days=1)
+    return frames, missing
+
+_config = None
+
+def init_worker(config):
+    global _config
+    _config = config
+
+def render_frame(image_path, values, output_path):
+    """Render the overlay on one frame from its recorded values, runs in a worker process."""
+    from overlay import render_overlay, render_values_band
+
+    with Image.open(image_path) as img:
+        exif = img.info.get('exif', b'')
+        if values.get('burned', False):
+            # The band covers the same rows every time, so a new one can be drawn over the old one
+            img = img.convert('RGB')
+            img.paste(render_values_band(values, img.width), (0, 0))
+        else:
+            img = render_overlay(_config, img.convert('RGB'), values=values)
+
+    # Written under a temporary name, an interrupted run never leaves a broken frame
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    temp_path = output_path + '.tmp'
+    img.save(temp_path, format='JPEG', quality=_config['image_quality'], exif=exif)
+    os.replace(temp_path, output_path)
+
+def get_journal_path(start, end, output):
+    """Return the file listing the frames a run over this range has finished."""
+    name = f"overlay_batch_{start:%Y%m%d%H%M%S}_{end:%Y%m%d%H%M%S}{'_copy' if output else ''}.txt"
+    return os.path.join(PROJECT_DIR, 'logs', name)
+
+def load_journal(journal_path):
+    try:
+        with open(journal_path, 'r') as journal:
+            return set(line.rstrip('\n') for line in journal)
+    except FileNotFoundError:
+        return set()
+
+def run(config, frames, output, workers, max_pending, journal_path):
+    """
+    Render the frames on a pool of processes and record each finished frame in the journal.
+
+    At most max_pending frames are handed to the pool at once, so memory use stays flat
+    for long ranges.
+    :return: Tuple of (rendered, failed).
+    """
+    root_folder = config['image_output']['root_folder']
+    rendered = failed = 0
+    start = time.monotonic()
+    os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+
+    with open(journal_path, 'a') as journal, ProcessPoolExecutor(workers, initializer=init_worker, initargs=(config,)) as executor:
+        pending = {}
+
+        def collect(done):
+            nonlocal rendered, failed
+            for future in done:
+                image_path = pending.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Failed to render {image_path}: {e}")
+                    failed += 1
+                    continue
+                journal.write(image_path + '\n')
+                journal.flush()
+                rendered += 1
+                if rendered % 50 == 0:
+                    print(f"{rendered}/{len(frames)} frames, {rendered / (time.monotonic() - start):.1f} frames/s")
+
+        for image_path, values in frames:
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            output_path = os.path.join(output, os.path.relpath(image_path, root_folder)) if output else image_path
+            pending[executor.submit(render_frame, image_path, values, output_path)] = image_path
+        collect(wait(pending)[0])
+    return rendered, failed
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    config = load_config(args.config, sections=('images', 'overlay'))
+
+    frames, missing = find_frames(config, args.start, args.end)
+    if missing:
+        # Burn mode only records the values with overlay.record_values, which is off by default
+        print(f"Skipping {missing} frames between {args.start} and {args.end} without recorded overlay values, "
+              "frames captured in burn mode are only recorded with overlay.record_values: True")
+        if not frames:
+            sys.exit(1)
+    if not args.output:
+        # Frames stored without overlay would end up with it burned in while their record says otherwise
+        kept = [frame for frame in frames if frame[1].get('burned', False)]
+        if len(kept) < len(frames):
+            print(f"{len(frames) - len(kept)} frames are stored without overlay, give --output to render them")
+        frames = kept
+
+    journal_path = get_journal_path(args.start, args.end, args.output)
+    if args.restart and os.path.exists(journal_path):
+        os.remove(journal_path)
+    finished = load_journal(journal_path)
+    todo = [frame for frame in frames if frame[0] not in finished]
+    print(f"{len(todo)} frames to render between {args.start} and {args.end}, {len(frames) - len(todo)} already done")
+
+    start = time.monotonic()
+    rendered, failed = run(config, todo, args.output, args.workers, args.max_pending or args.workers * 2, journal_path)
+    seconds = time.monotonic() - start
+    print(f"{rendered} frames in {seconds:.1f}s: {rendered / seconds if seconds else 0:.2f} frames/s with {args.workers} workers, {failed} failed")
@@ -0,0 +1,30 @@
+#!/usr/bin/python
+import os
+import json
+
+RECORD_FILE = 'overlay.jsonl'
+
+def record_overlay_values(file_name, values):
+    """Append the overlay values of a frame as one line to the overlay.jsonl in its folder."""
+    folder = os.path.dirname(file_name)
+    os.makedirs(folder, exist_ok=True)
+    line = json.dumps(dict(values, file=os.path.basename(file_name)), separators=(',', ':'))
+    # A single short append, lines written by parallel workers do not interleave
+    with open(os.path.join(folder, RECORD_FILE), 'a') as record_file:
+        record_file.write(line + '\n')
+
+def load_overlay_records(folder):
+    """Return {file name: overlay values} from the overlay.jsonl in folder, empty if there is none."""
+    records = {}
+    try:
+        with open(os.path.join(folder, RECORD_FILE), 'r') as record_file:
+            for line in record_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+                records[record.pop('file')] = record
+    except FileNotFoundError:
+        pass
+    return records
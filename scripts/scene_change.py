@@ -0,0 +1,71 @@
+#!/usr/bin/python
+import os
+import numpy as np
+
+def lores_luma(array, height):
+    """Return the Y plane of a YUV420 lores array, or a gray version of an RGB one."""
+    if array.ndim == 2:
+        return array[:height]
+    return array[..., :3].mean(axis=2)
+
+def block_mean(luma, block=4):
+    """Average block x block pixels to suppress sensor noise before comparing frames."""
+    height = luma.shape[0] - luma.shape[0] % block
+    width = luma.shape[1] - luma.shape[1] % block
+    blocks = luma[:height, :width].reshape(height // block, block, width // block, block)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+class SceneChangeDetector:
+    """
+    Decide if a frame differs enough from the last kept frame to be worth storing.
+
+    The score is the mean absolute difference of the block-averaged lores luma, scaled
+    to 0-1. Every max_skipped frames one is kept regardless, so the status image and
+    the video never go stale for long.
+    """
+
+    def __init__(self, threshold=0.02, max_skipped=10, block=4):
+        self.threshold = threshold
+        self.max_skipped = max_skipped
+        self.block = block
+        self.reference = None
+        self.skipped = 0
+        self.last_score = None
+
+    def score(self, luma):
+        """Return the difference between luma and the last kept frame, 1.0 if there is none."""
+        small = block_mean(luma, self.block)
+        if self.reference is None or self.reference.shape != small.shape:
+            return 1.0, small
+        return float(np.abs(small - self.reference).mean() / 255.0), small
+
+    def should_keep(self, luma):
+        """Return True if the frame should be stored, and remember it as the new reference if so."""
+        self.last_score, small = self.score(luma)
+        if self.last_score >= self.threshold or self.skipped >= self.max_skipped:
+            self.reference = small
+            self.skipped = 0
+            return True
+        self.skipped += 1
+        return False
+
+def create_change_detector(config):
+    """
+    Create a SceneChangeDetector from the change_detection config section.
+
+    When change detection is off but the adaptive interval is on, the detector only measures
+    scene activity and keeps every frame. Returns None if neither is enabled.
+    """
+    change_detection = config.get('change_detection', {})
+    if change_detection.get('enabled', False):
+        return SceneChangeDetector(change_detection.get('threshold', 0.02), change_detection.get('max_skipped', 10))
+    if config.get('adaptive_interval', {}).get('enabled', False):
+        return SceneChangeDetector(threshold=0.0)
+    return None
+
+def write_skip_marker(file_name, score):
+    """Record a skipped frame in skipped_frames.txt next to where it would have been stored."""
+    marker_file = os.path.join(os.path.dirname(file_name), 'skipped_frames.txt')
+    os.makedirs(os.path.dirname(marker_file), exist_ok=True)
+    with open(marker_file, 'a') as file:
+        file.write(f"{os.path.basename(file_name)} {score:.4f}\n")
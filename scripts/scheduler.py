@@ -0,0 +1,74 @@
+#!/usr/bin/python
+import time
+from .logger import log_message
+
+class DeadlineScheduler:
+    """
+    Fire capture ticks on fixed deadlines of a monotonic clock.
+
+    Deadlines are spaced by the interval regardless of how long each capture takes,
+    so the real period does not drift. Ticks that are missed while a capture overruns
+    are either skipped (wait for the next deadline) or coalesced into one immediate tick.
+    """
+
+    def __init__(self, interval, align_to_clock=False, late_policy='skip', late_tolerance=None,
+                 clock=time.monotonic, wall_clock=time.time, sleep=time.sleep):
+        if late_policy not in ('skip', 'coalesce'):
+            raise ValueError(f"Unknown late policy: {late_policy}")
+        self.interval = interval
+        self.align_to_clock = align_to_clock
+        self.late_policy = late_policy
+        # How late a tick may fire before it counts as missed, a quarter interval unless given
+        self.fixed_tolerance = late_tolerance
+        self.late_tolerance = late_tolerance if late_tolerance is not None else interval / 4
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.sleep = sleep
+        self.next_deadline = None
+        self.last_deadline = None
+        self.overruns = 0
+        self.skipped_ticks = 0
+
+    def first_deadline(self, now):
+        """Return the first deadline, optionally aligned to a wall-clock multiple of the interval."""
+        if not self.align_to_clock:
+            return now
+        return now + (self.interval - self.wall_clock() % self.interval) % self.interval
+
+    def wait(self):
+        """Sleep until the next deadline and return the monotonic time it was scheduled for."""
+        now = self.clock()
+        if self.next_deadline is None:
+            self.next_deadline = self.first_deadline(now)
+
+        lateness = now - self.next_deadline
+        if lateness > self.late_tolerance:
+            missed = int(lateness // self.interval) + 1
+            self.overruns += 1
+            if self.late_policy == 'skip':
+                # Drop every deadline that has passed and wait for the next one
+                self.next_deadline += missed * self.interval
+                self.skipped_ticks += missed
+                log_message(f"Capture overran by {lateness:.1f}s, skipping {missed} tick(s)")
+            else:
+                # Fire once now for all the missed deadlines and continue on the same grid
+                self.next_deadline += (missed - 1) * self.interval
+                self.skipped_ticks += missed - 1
+                log_message(f"Capture overran by {lateness:.1f}s, coalescing {missed} tick(s) into one")
+
+        delay = self.next_deadline - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+
+        deadline = self.next_deadline
+        self.last_deadline = deadline
+        self.next_deadline += self.interval
+        return deadline
+
+    def set_interval(self, interval):
+        """Change the interval, the next deadline is moved to the last deadline plus the new interval."""
+        self.interval = interval
+        if self.fixed_tolerance is None:
+            self.late_tolerance = interval / 4
+        if self.last_deadline is not None:
+            self.next_deadline = self.last_deadline + interval
@@ -1,5 +1,4 @@
 import requests
-import yaml
 import os
 import sys
 from new_logger import Logger
@@ -10,11 +9,7 @@ logger = Logger('server-request.log')
 # Add the directory containing your script to the Python path
 script_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(script_dir)
-
-def load_config():
-    config_path = os.path.join(script_dir, '../config.yaml')
-    with open(config_path, 'r') as file:
-        return yaml.safe_load(file)
+from config import load_config
 
 def send_request(config, endpoint, payload=None):
     try:
@@ -47,7 +42,7 @@ def reboot_system():
 
 def main():
     logger.log_message("Starting server request script")
-    config = load_config()
+    config = load_config(sections=('remote',))
 
     # Send initial request to the server
     response = send_request(config, '/api/piRequest')
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+import datetime
+import functools
+import numpy as np
+from .config import validate_config, ConfigError
+
+# Zenith angles for the events, 90.833 includes refraction and the radius of the sun
+SUNRISE_ZENITH = 90.833
+CIVIL_TWILIGHT_ZENITH = 96.0
+
+def julian_day(timestamps):
+    """Convert POSIX timestamps (seconds, UTC) to Julian days."""
+    return np.asarray(timestamps, dtype=np.float64) / 86400.0 + 2440587.5
+
+def sun_position(jd):
+    """
+    Return the solar declination (radians) and the equation of time (minutes) for Julian days.
+
+    NOAA solar calculator formulas, valid to about a minute for years 1800-2100.
+    """
+    t = (jd - 2451545.0) / 36525.0
+    mean_long = np.radians((280.46646 + t * (36000.76983 + t * 0.0003032)) % 360)
+    mean_anom = np.radians(357.52911 + t * (35999.05029 - 0.0001537 * t))
+    eccent = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+    center = (np.sin(mean_anom) * (1.914602 - t * (0.004817 + 0.000014 * t))
+              + np.sin(2 * mean_anom) * (0.019993 - 0.000101 * t)
+              + np.sin(3 * mean_anom) * 0.000289)
+    omega = np.radians(125.04 - 1934.136 * t)
+    app_long = np.radians(np.degrees(mean_long) + center - 0.00569 - 0.00478 * np.sin(omega))
+    mean_obliq = 23 + (26 + (21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))) / 60) / 60
+    obliq = np.radians(mean_obliq + 0.00256 * np.cos(omega))
+
+    declination = np.arcsin(np.sin(obliq) * np.sin(app_long))
+    y = np.tan(obliq / 2) ** 2
+    eq_time = 4 * np.degrees(y * np.sin(2 * mean_long)
+                             - 2 * eccent * np.sin(mean_anom)
+                             + 4 * eccent * y * np.sin(mean_anom) * np.cos(2 * mean_long)
+                             - 0.5 * y * y * np.sin(4 * mean_long)
+                             - 1.25 * eccent * eccent * np.sin(2 * mean_anom))
+    return declination, eq_time
+
+def solar_elevation(timestamps, latitude, longitude):
+    """Return the solar elevation in degrees (without refraction) for POSIX timestamps."""
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    declination, eq_time = sun_position(julian_day(timestamps))
+    minutes = (timestamps % 86400) / 60.0
+    hour_angle = np.radians((minutes + eq_time + 4 * longitude) / 4 - 180)
+    lat = np.radians(latitude)
+    cos_zenith = np.sin(lat) * np.sin(declination) + np.cos(lat) * np.cos(declination) * np.cos(hour_angle)
+    return 90 - np.degrees(np.arccos(np.clip(cos_zenith, -1, 1)))
+
+def event_offsets(day_starts, latitude, longitude, zenith, iterations=2):
+    """
+    Return the UTC rise and set times (POSIX seconds) for a zenith angle on each day.
+
+    Days where the sun stays above the zenith angle get NaN and polar = +1,
+    days where it stays below get NaN and polar = -1.
+    """
+    lat = np.radians(latitude)
+    noon = day_starts + (720 - 4 * longitude) * 60.0
+    rise = noon.copy()
+    sett = noon.copy()
+    for _ in range(iterations):
+        # Evaluate the sun position at the estimated event times to refine them
+        results = []
+        for estimate, sign in ((rise, -1), (sett, 1)):
+            declination, eq_time = sun_position(julian_day(estimate))
+            cos_ha = np.cos(np.radians(zenith)) / (np.cos(lat) * np.cos(declination)) - np.tan(lat) * np.tan(declination)
+            hour_angle = np.degrees(np.arccos(np.clip(cos_ha, -1, 1)))
+            solar_noon = day_starts + (720 - 4 * longitude - eq_time) * 60.0
+            results.append((solar_noon + sign * 4 * hour_angle * 60.0, cos_ha))
+        (rise, cos_rise), (sett, cos_set) = results
+
+    polar = np.where(cos_rise < -1, 1, np.where(cos_rise > 1, -1, 0))
+    rise = np.where(polar == 0, rise, np.nan)
+    sett = np.where((cos_set >= -1) & (cos_set <= 1), sett, np.nan)
+    return rise, sett, polar
+
+def sun_table(dates, latitude, longitude):
+    """
+    Compute sun events for many dates in one vectorized call.
+
+    :param dates: Sequence of datetime.date.
+    :return: Dict of numpy arrays with POSIX UTC seconds (NaN where the event does not happen)
+             for sunrise, sunset, civil_dawn, civil_dusk and solar_noon, and polar which is
+             1 for polar day, -1 for polar night and 0 otherwise.
+    """
+    day_starts = np.array([datetime.datetime(d.year, d.month, d.day, tzinfo=datetime.timezone.utc).timestamp() for d in dates])
+    sunrise, sunset, polar = event_offsets(day_starts, latitude, longitude, SUNRISE_ZENITH)
+    civil_dawn, civil_dusk, _ = event_offsets(day_starts, latitude, longitude, CIVIL_TWILIGHT_ZENITH)
+    _, eq_time = sun_position(julian_day(day_starts + 43200))
+    solar_noon = day_starts + (720 - 4 * longitude - eq_time) * 60.0
+    return {
+        "sunrise": sunrise,
+        "sunset": sunset,
+        "civil_dawn": civil_dawn,
+        "civil_dusk": civil_dusk,
+        "solar_noon": solar_noon,
+        "polar": polar,
+    }
+
+def to_local(timestamp):
+    """Convert POSIX seconds to a naive local datetime, or None for NaN."""
+    if np.isnan(timestamp):
+        return None
+    return datetime.datetime.fromtimestamp(float(timestamp))
+
+@functools.lru_cache(maxsize=8)
+def get_sun_times(date, latitude, longitude):
+    """
+    Return the sun events of one date as naive local datetimes, cached per day.
+
+    :return: Dict with sunrise, sunset, civil_dawn, civil_dusk and solar_noon (None when the
+             event does not happen that day) and polar: 'day', 'night' or None.
+    """
+    table = sun_table([date], latitude, longitude)
+    times = {key: to_local(values[0]) for key, values in table.items() if key != 'polar'}
+    times["polar"] = {1: 'day', -1: 'night'}.get(int(table["polar"][0]))
+    return times
+
+def get_location(config):
+    """
+    Return (latitude, longitude) from the location section of the config.
+
+    :raises ConfigError: if the location is missing or not numbers.
+    """
+    problems = validate_config(config, ('location',))
+    if problems:
+        raise ConfigError("The sun times need location.latitude and location.longitude in the config:\n  " + "\n  ".join(problems))
+    return config['location']['latitude'], config['location']['longitude']
+
+def get_sun(config, date):
+    """Return the sun events of a date at the location in the config."""
+    latitude, longitude = get_location(config)
+    return get_sun_times(date, latitude, longitude)
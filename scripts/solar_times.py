@@ -1,50 +1,50 @@
-import requests
+#!/usr/bin/python
+import os
+import sys
 import json
-from datetime import datetime, timedelta
+import argparse
+import datetime
 
-BASE_URL = "https://api.sunrise-sunset.org/json?lat=68.7252112&lng=15.4506372&formatted=0&date="
+# Allow running as python scripts/solar_times.py from the project folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts.solar import sun_table, to_local
+from scripts.config import load_config
 
-def fetch_sun_data(date_str):
-    response = requests.get(BASE_URL + date_str)
-    data = response.json()['results']
-    return data
-
-def process_data(data):
-    sunrise, sunset, solar_noon = data['sunrise'], data['sunset'], data['solar_noon']
-
-    if sunrise == "1970-01-01T00:00:01+00:00":
-        sunrise = "never_rises"
-    
-    if sunset == "1970-01-01T00:00:01+00:00":
-        sunset = "never_sets"
-
-    return {
-        "sunrise": sunrise,
-        "sunset": sunset,
-        "solar_noon": solar_noon
-    }
-
-def main():
-    start_date = datetime.strptime("2023-01-01", "%Y-%m-%d")
-    end_date = datetime.strptime("2023-12-31", "%Y-%m-%d")
-    delta = timedelta(days=1)
+def build_year(year, latitude, longitude):
+    """Compute sunrise, sunset, civil twilight and solar noon for every day of a year in one call."""
+    start_date = datetime.date(year, 1, 1)
+    dates = [start_date + datetime.timedelta(days=i) for i in range((datetime.date(year + 1, 1, 1) - start_date).days)]
+    table = sun_table(dates, latitude, longitude)
 
     result = {}
+    for i, date in enumerate(dates):
+        day = {}
+        for key in ('sunrise', 'sunset', 'civil_dawn', 'civil_dusk', 'solar_noon'):
+            local_time = to_local(table[key][i])
+            day[key] = local_time.strftime('%H:%M') if local_time else None
+        day['polar'] = {1: 'day', -1: 'night'}.get(int(table['polar'][i]))
+        result[date.strftime('%m-%d')] = day
+    return result
 
-    while start_date <= end_date:
-        date_str = start_date.strftime("%Y-%m-%d")
-        date_key = start_date.strftime("%m-%d")
-        
-        sun_data = fetch_sun_data(date_str)
-        processed_data = process_data(sun_data)
-        
-        result[date_key] = processed_data
-        
-        start_date += delta
-
-    with open("sun_data_2023.json", "w") as file:
-        json.dump(result, file, indent=4)
+def main():
+    parser = argparse.ArgumentParser(description="Print or save the sun times for a year, computed offline.")
+    parser.add_argument("--year", type=int, default=datetime.date.today().year, help="Year to compute")
+    parser.add_argument("--lat", type=float, help="Latitude, defaults to location in config.yaml")
+    parser.add_argument("--lon", type=float, help="Longitude, defaults to location in config.yaml")
+    parser.add_argument("--output", help="JSON file to write, prints to stdout if not set")
+    args = parser.parse_args()
+
+    latitude, longitude = args.lat, args.lon
+    if latitude is None or longitude is None:
+        config = load_config(sections=('location',))
+        latitude, longitude = config['location']['latitude'], config['location']['longitude']
+
+    result = build_year(args.year, latitude, longitude)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=4)
+    else:
+        print(json.dumps(result, indent=4))
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+import math
+import numpy as np
+
+def plan_stack(shutter_speed, gain, max_sub_exposure, max_depth, max_gain):
+    """
+    Split one long exposure into a stack of shorter ones with the same total signal.
+
+    Each sub-exposure is shutter_speed / depth long. The gain is raised by the same factor
+    (up to max_gain) so every sub-frame is as bright as the single exposure would have been,
+    and any signal that could not be made up with gain is returned as a digital scale.
+    :return: Dict with depth, sub_exposure, sub_gain and scale.
+    """
+    depth = max(1, min(max_depth, math.ceil(shutter_speed / max_sub_exposure)))
+    sub_exposure = int(shutter_speed / depth)
+    sub_gain = min(gain * depth, max_gain)
+    scale = (shutter_speed * gain) / (sub_exposure * sub_gain)
+    return {"depth": depth, "sub_exposure": sub_exposure, "sub_gain": sub_gain, "scale": max(1.0, scale)}
+
+class FrameStacker:
+    """
+    Combine a stack of 8-bit frames into one with less noise.
+
+    'mean' keeps a single float32 running sum, 'median' needs every frame and preallocates
+    a depth x height x width x channels uint8 buffer on the first frame.
+    """
+
+    def __init__(self, depth, method='mean'):
+        if method not in ('mean', 'median'):
+            raise ValueError(f"Unknown stacking method: {method}")
+        self.depth = depth
+        self.method = method
+        self.count = 0
+        self.buffer = None
+
+    def add(self, frame):
+        """Add one frame to the stack."""
+        if self.count >= self.depth:
+            raise ValueError("Stack is already full")
+        if self.buffer is None:
+            if self.method == 'mean':
+                self.buffer = np.zeros(frame.shape, dtype=np.float32)
+            else:
+                self.buffer = np.empty((self.depth,) + frame.shape, dtype=np.uint8)
+
+        if self.method == 'mean':
+            np.add(self.buffer, frame, out=self.buffer, casting='unsafe')
+        else:
+            self.buffer[self.count] = frame
+        self.count += 1
+
+    def result(self, scale=1.0):
+        """
+        Return the combined frame as uint8.
+
+        scale brightens the result to make up for signal missing from the sub-exposures,
+        it is applied in approximately linear light (gamma 2.2) since the frames are gamma encoded.
+        """
+        if self.count == 0:
+            raise ValueError("No frames in the stack")
+        if self.method == 'mean':
+            combined = self.buffer / self.count
+        else:
+            combined = np.median(self.buffer[:self.count], axis=0)
+
+        if scale != 1.0:
+            combined = combined / 255.0
+            np.power(combined, 2.2, out=combined)
+            combined *= scale
+            np.clip(combined, 0.0, 1.0, out=combined)
+            np.power(combined, 1 / 2.2, out=combined)
+            combined *= 255.0
+        return np.clip(np.rint(combined), 0, 255).astype(np.uint8)
@@ -0,0 +1,47 @@
+#!/usr/bin/python
+import time
+import threading
+import contextlib
+
+class StageTimer:
+    """Collect how long each pipeline stage takes, from any thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.durations.setdefault(stage, []).append(seconds)
+
+    def summary(self):
+        """Return count, mean, p95 and max in milliseconds per stage."""
+        import numpy as np
+
+        with self.lock:
+            durations = {stage: np.array(values) * 1000 for stage, values in self.durations.items()}
+        return {
+            stage: {"count": len(values), "mean": float(values.mean()), "p95": float(np.percentile(values, 95)), "max": float(values.max())}
+            for stage, values in durations.items()
+        }
+
+# Timing is off unless a harness enables it, timed() then costs one check
+_timer = None
+
+def enable_stage_timing():
+    """Start collecting stage timings in this process and return the timer."""
+    global _timer
+    _timer = StageTimer()
+    return _timer
+
+@contextlib.contextmanager
+def timed(stage):
+    """Time the block as a pipeline stage when timing is enabled."""
+    if _timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timer.record(stage, time.perf_counter() - start)
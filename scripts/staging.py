@@ -0,0 +1,230 @@
+#!/usr/bin/python
+import os
+import time
+import fcntl
+import threading
+from .logger import log_message
+from .stage_timer import timed
+
+# Work files untouched for this long belong to a capture that crashed
+STALE_AFTER = 120
+FSYNC_POLICIES = ('file', 'batch', 'none')
+
+def is_complete_jpeg(path):
+    """Check for the JPEG end marker, a crash while writing leaves a truncated file."""
+    try:
+        with open(path, 'rb') as file:
+            file.seek(-2, os.SEEK_END)
+            return file.read(2) == b'\xff\xd9'
+    except OSError:
+        return False
+
+class StagingArea:
+    """
+    Finish frames on a RAM disk and move them to the SD card in batches.
+
+    A frame is captured, overlaid and published from work/, which mirrors the absolute path
+    the frame will end up at. commit() renames it into ready/, and flush() writes each ready
+    frame to its final path with a single write. The staging folder itself is the queue, so
+    frames left behind by a crash are picked up again by recover().
+    """
+
+    def __init__(self, folder, batch_size=10, max_age=300, fsync='batch'):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"staging.fsync should be one of {', '.join(FSYNC_POLICIES)}, got {fsync!r}")
+        self.folder = folder
+        self.work = os.path.join(folder, 'work')
+        self.ready = os.path.join(folder, 'ready')
+        self.lock_file = os.path.join(folder, 'flush.lock')
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.fsync = fsync
+
+    def work_path(self, file_name):
+        """Return the path a frame bound for file_name is written to, creating its folder."""
+        path = os.path.join(self.work, os.path.abspath(file_name).lstrip(os.sep))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def is_staged(self, path):
+        return os.path.abspath(path).startswith(self.work + os.sep)
+
+    def final_path(self, path):
+        """Return where a staged frame ends up, other paths are returned unchanged."""
+        path = os.path.abspath(path)
+        for root in (self.work, self.ready):
+            if path.startswith(root + os.sep):
+                return os.sep + os.path.relpath(path, root)
+        return path
+
+    def commit(self, path):
+        """Mark a finished frame in work/ as ready to be flushed."""
+        ready_path = os.path.join(self.ready, os.path.relpath(path, self.work))
+        os.makedirs(os.path.dirname(ready_path), exist_ok=True)
+        os.replace(path, ready_path)
+
+    def ready_files(self):
+        return sorted(os.path.join(folder, name) for folder, _, names in os.walk(self.ready) for name in names)
+
+    def due(self):
+        """Return True if a batch is full or the oldest ready frame has waited max_age seconds."""
+        files = self.ready_files()
+        if len(files) >= self.batch_size:
+            return True
+        try:
+            return bool(files) and time.time() - min(os.path.getmtime(f) for f in files) >= self.max_age
+        except FileNotFoundError:
+            # Flushed by another process meanwhile
+            return False
+
+    def write(self, path):
+        """Write a ready frame next to its final path and return (staged path, temporary path, final path)."""
+        final_path = self.final_path(path)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        with open(path, 'rb') as file:
+            data = file.read()
+        part_path = final_path + '.part'
+        with open(part_path, 'wb') as file:
+            file.write(data)
+            if self.fsync == 'file':
+                file.flush()
+                os.fsync(file.fileno())
+        stat = os.stat(path)
+        os.utime(part_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        return path, part_path, final_path
+
+    def flush(self):
+        """
+        Move all ready frames to their final paths and return how many were moved.
+
+        Each frame is written to a .part file, then all of them are synced according to the
+        fsync policy and renamed into place, so a crash never leaves a truncated frame at
+        its final path. Only one process or thread flushes at a time, others return 0.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.lock_file, 'w') as lock, timed('flush'):
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+
+            written = []
+            for path in self.ready_files():
+                try:
+                    written.append(self.write(path))
+                except OSError as e:
+                    log_message(f"Failed to flush {path}: {e}")
+            if self.fsync == 'batch' and written:
+                os.sync()
+            for path, part_path, final_path in written:
+                os.replace(part_path, final_path)
+            if self.fsync != 'none' and written:
+                # Make the renames durable before the staged copies are dropped
+                for folder in {os.path.dirname(final_path) for _, _, final_path in written}:
+                    fd = os.open(folder, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+            for path, _, _ in written:
+                os.remove(path)
+        return len(written)
+
+    def flush_if_due(self):
+        return self.flush() if self.due() else 0
+
+    def recover(self, stale_after=STALE_AFTER):
+        """
+        Pick up frames left in work/ by a capture that crashed.
+
+        Complete frames are committed as they are, truncated ones are dropped. Only files
+        untouched for stale_after seconds are considered, others may still be in use.
+        """
+        now = time.time()
+        for folder, _, names in os.walk(self.work):
+            for name in names:
+                path = os.path.join(folder, name)
+                try:
+                    if now - os.path.getmtime(path) < stale_after:
+                        continue
+                    if is_complete_jpeg(path):
+                        log_message(f"Recovered staged frame {self.final_path(path)}")
+                        self.commit(path)
+                    else:
+                        log_message(f"Dropped truncated staged frame {self.final_path(path)}")
+                        os.remove(path)
+                except FileNotFoundError:
+                    continue
+
+class StagingFlusher:
+    """Flush a staging area from a background thread whenever a batch is due."""
+
+    def __init__(self, staging_area, check_interval=5):
+        self.staging_area = staging_area
+        self.check_interval = check_interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="staging-flush", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.check_interval):
+            try:
+                self.staging_area.flush_if_due()
+            except OSError as e:
+                log_message(f"Staging flush failed: {e}")
+
+    def close(self):
+        """Stop the thread and flush what is left."""
+        self.stop_event.set()
+        self.thread.join()
+        self.staging_area.flush()
+
+_staging_areas = {}
+_staging_areas_lock = threading.Lock()
+
+def get_staging_area(config):
+    """Return the shared StagingArea of the staging config section, or None if staging is disabled."""
+    staging = config.get('staging', {})
+    if not staging.get('enabled', False):
+        return None
+    folder = os.path.abspath(staging.get('folder', '/dev/shm/timelapse'))
+    key = (folder, staging.get('batch_size', 10), staging.get('max_age', 300), staging.get('fsync', 'batch'))
+    with _staging_areas_lock:
+        if key not in _staging_areas:
+            _staging_areas[key] = StagingArea(*key)
+        return _staging_areas[key]
+
+def get_final_path(config, file_name):
+    """Return where a frame ends up on persistent storage, which is file_name itself without staging."""
+    staging_area = get_staging_area(config)
+    return staging_area.final_path(file_name) if staging_area is not None else file_name
+
+def commit_frame(config, file_name):
+    """Hand a finished frame to the staging area for flushing, returns its final path."""
+    staging_area = get_staging_area(config)
+    if staging_area is None or not staging_area.is_staged(file_name):
+        return file_name
+    staging_area.commit(file_name)
+    return staging_area.final_path(file_name)
+
+def flush_staging(config, force=False, stale_after=STALE_AFTER):
+    """
+    Recover crashed frames and flush the staging area if a batch is due, or always with force.
+
+    Used by the scripts that run once per frame, which have no background flusher.
+    """
+    staging_area = get_staging_area(config)
+    if staging_area is None:
+        return 0
+    staging_area.recover(stale_after)
+    return staging_area.flush() if force else staging_area.flush_if_due()
+
+def start_staging_flusher(config):
+    """Replay what a previous run left in the staging area and start flushing it in the background."""
+    staging_area = get_staging_area(config)
+    if staging_area is None:
+        return None
+    # Nothing else writes to the staging area before the timelapse starts, so every
+    # frame in work/ is left over, even one from a crash seconds ago
+    flush_staging(config, force=True, stale_after=0)
+    return StagingFlusher(staging_area, config['staging'].get('check_interval', 5))
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+ENTRYPOINTS = ['capture_image', 'capture_image_night', 'overlay', 'capture_service', 'timelapse']
+
+# Runs in a fresh interpreter for every measurement
+IMPORT_CODE = """
+import sys, time, json
+start = time.perf_counter()
+__import__(sys.argv[1])
+print(json.dumps({"import": time.perf_counter() - start}))
+"""
+
+FIRST_FRAME_CODE = """
+import os, sys, time, json, argparse, tempfile
+start = time.perf_counter()
+from capture_service import CameraService
+from scripts.config import load_config
+from scripts.load_test import build_test_config
+from scripts.camera_state import get_camera_state
+from scripts.logger import set_log_folder
+imported = time.perf_counter()
+args = argparse.Namespace(frame_time=0.0, size=None, no_overlay=sys.argv[2] == 'no-overlay', queue=False, workers=1, staging=False)
+get_camera_state().mirror = False
+with tempfile.TemporaryDirectory(prefix='timelapse-startup-') as output:
+    set_log_folder(os.path.join(output, 'logs'))
+    with CameraService(build_test_config(load_config(sys.argv[1]), args, output)) as service:
+        service.capture_day()
+    first_frame = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_frame": first_frame - start}))
+"""
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measure import and first-frame time of the capture entrypoints.")
+    parser.add_argument("--config", default=os.path.join(PROJECT_DIR, 'example_config.yaml'), help="Config for the first-frame run.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the median is reported.")
+    parser.add_argument("--no-overlay", action="store_true", help="Skip the overlay in the first-frame run.")
+    parser.add_argument("--importtime", metavar="MODULE", help="List the slowest imports of one module instead.")
+    parser.add_argument("--log", default=os.path.join(PROJECT_DIR, 'logs', 'startup.csv'), help="CSV the results are appended to.")
+    return parser.parse_args()
+
+def run_child(code, *args):
+    """Run code in a new interpreter from the project folder and return (its JSON output, wall seconds)."""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code, *args], cwd=PROJECT_DIR, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), wall
+
+def slowest_imports(module, count=15):
+    """Return the slowest (cumulative microseconds, module) pairs from python -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=PROJECT_DIR, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+def measure(args):
+    """Return {name: {metric: median seconds}} for every entrypoint and the first frame."""
+    results = {}
+    for module in ENTRYPOINTS:
+        runs = [run_child(IMPORT_CODE, module) for _ in range(args.repeat)]
+        results[module] = {"import": statistics.median(r[0]["import"] for r in runs), "process": statistics.median(r[1] for r in runs)}
+    runs = [run_child(FIRST_FRAME_CODE, args.config, 'no-overlay' if args.no_overlay else 'overlay') for _ in range(args.repeat)]
+    results["first_frame"] = {
+        "import": statistics.median(r[0]["import"] for r in runs),
+        "first_frame": statistics.median(r[0]["first_frame"] for r in runs),
+        "process": statistics.median(r[1] for r in runs),
+    }
+    return results
+
+def log_results(log_path, results):
+    """Append one row per measurement to the CSV, so changes in startup time show up over time."""
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    write_header = not os.path.exists(log_path)
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+    with open(log_path, 'a') as log_file:
+        if write_header:
+            log_file.write("time,name,metric,seconds\n")
+        for name, metrics in results.items():
+            for metric, seconds in metrics.items():
+                log_file.write(f"{timestamp},{name},{metric},{seconds:.4f}\n")
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.importtime:
+        for cumulative, name in slowest_imports(args.importtime):
+            print(f"{cumulative / 1000:>9.1f} ms  {name}")
+        sys.exit()
+
+    results = measure(args)
+    print(f"{'name':<20} {'import s':>9} {'first frame s':>14} {'process s':>10}")
+    for name, metrics in results.items():
+        first_frame = f"{metrics['first_frame']:.3f}" if 'first_frame' in metrics else ''
+        print(f"{name:<20} {metrics['import']:>9.3f} {first_frame:>14} {metrics['process']:>10.3f}")
+    log_results(args.log, results)
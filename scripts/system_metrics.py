@@ -0,0 +1,262 @@
+#!/usr/bin/python
+import os
+import csv
+import json
+import time
+import argparse
+import threading
+import subprocess
+from collections import deque
+from datetime import datetime
+from .logger import log_message
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+THERMAL_ZONE = '/sys/class/thermal/thermal_zone0/temp'
+# Samples kept in the mirror file for other processes, enough for the sparklines
+MIRROR_SAMPLES = 120
+# Persisted samples are appended in batches, one SD card write every few minutes
+PERSIST_BATCH = 30
+FIELDS = ('time', 'cpu_temp', 'throttled', 'mem_used', 'mem_total', 'mem_percent', 'disk_used', 'disk_total', 'disk_percent', 'load1', 'load5', 'load15', 'photos', 'photos_size')
+# Bits of vcgencmd get_throttled, the same bits shifted by 16 mean it happened since boot
+THROTTLE_FLAGS = {
+    0: 'under-voltage',
+    1: 'frequency capped',
+    2: 'throttled',
+    3: 'soft temperature limit',
+}
+
+def read_cpu_temperature():
+    """Return the CPU temperature in °C from the thermal zone, without starting vcgencmd."""
+    try:
+        with open(THERMAL_ZONE, 'r') as file:
+            return int(file.read()) / 1000
+    except (OSError, ValueError):
+        pass
+    from .piDataStats import get_cpu_temperature
+    try:
+        temperature = get_cpu_temperature()
+        return None if temperature is None else float(temperature)
+    except (OSError, ValueError):
+        return None
+
+def read_throttled():
+    """Return the throttling bits from vcgencmd get_throttled, or None off a Pi."""
+    try:
+        result = subprocess.run(['vcgencmd', 'get_throttled'], capture_output=True, text=True, timeout=2)
+        return int(result.stdout.strip().split('=')[1], 16)
+    except (OSError, subprocess.SubprocessError, IndexError, ValueError):
+        return None
+
+def describe_throttled(throttled):
+    """Return the names of the throttling flags that are set now, e.g. ['under-voltage']."""
+    if not throttled:
+        return []
+    return [name for bit, name in THROTTLE_FLAGS.items() if throttled & (1 << bit)]
+
+def take_sample(disk_path='/'):
+    """Return one sample of the system metrics as a dict of numbers."""
+    import psutil
+    from .piDataStats import get_photos_captured_today
+
+    memory = psutil.virtual_memory()
+    disk = psutil.disk_usage(disk_path)
+    load1, load5, load15 = os.getloadavg()
+    photos, photos_size = get_photos_captured_today()
+    return {
+        'time': round(time.time(), 1),
+        'cpu_temp': read_cpu_temperature(),
+        'throttled': read_throttled(),
+        'mem_used': memory.used,
+        'mem_total': memory.total,
+        'mem_percent': memory.percent,
+        'disk_used': disk.used,
+        'disk_total': disk.total,
+        'disk_percent': disk.percent,
+        'load1': load1,
+        'load5': load5,
+        'load15': load15,
+        'photos': photos,
+        'photos_size': photos_size,
+    }
+
+def format_pi_values(sample):
+    """Return a sample as the strings scripts/piDataStats.get_pi_data gives, as shown in the band."""
+    from .piDataStats import format_size
+
+    cpu_temp = sample['cpu_temp']
+    return {
+        'CPU Temperature': None if cpu_temp is None else f"{cpu_temp:.1f}",
+        'Total Memory': format_size(sample['mem_total']),
+        'Used Memory': format_size(sample['mem_used']),
+        'Memory Usage Percentage': f"{sample['mem_percent']:.2f}%",
+        'Total Disk Space': format_size(sample['disk_total']),
+        'Used Disk Space': format_size(sample['disk_used']),
+        'Free Disk Space': format_size(sample['disk_total'] - sample['disk_used']),
+        'Disk Usage Percentage': f"{sample['disk_percent']:.2f}%",
+        'Load Average': f"{sample['load1']:.2f}, {sample['load5']:.2f}, {sample['load15']:.2f}",
+        'Photos Captured Today': sample['photos'],
+        'Total Size of Photos': format_size(sample['photos_size']),
+    }
+
+class MetricsSampler:
+    """
+    Sample the system metrics at a fixed rate from a background thread.
+
+    The samples are kept in a ring buffer of history entries, so the overlay reads the
+    latest one without touching psutil, /proc or vcgencmd on the frame path. The last
+    samples are mirrored to a small JSON file with an atomic rename, for capture scripts
+    running in other processes, and can be appended to a daily CSV file.
+    """
+
+    def __init__(self, interval=10, history=360, disk_path='/', mirror_file=None, persist_folder=None):
+        self.interval = interval
+        self.disk_path = disk_path
+        self.mirror_file = mirror_file
+        self.persist_folder = persist_folder
+        self.samples = deque(maxlen=history)
+        self.unsaved = []
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def latest(self):
+        """Return the newest sample, None before the first one."""
+        try:
+            return self.samples[-1]
+        except IndexError:
+            return None
+
+    def sample(self):
+        sample = take_sample(self.disk_path)
+        self.samples.append(sample)
+        if self.mirror_file:
+            self.write_mirror()
+        if self.persist_folder:
+            self.unsaved.append(sample)
+            if len(self.unsaved) >= PERSIST_BATCH:
+                self.persist()
+        return sample
+
+    def write_mirror(self):
+        os.makedirs(os.path.dirname(self.mirror_file), exist_ok=True)
+        temp_path = f"{self.mirror_file}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({'interval': self.interval, 'samples': list(self.samples)[-MIRROR_SAMPLES:]}, file, separators=(',', ':'))
+        os.replace(temp_path, self.mirror_file)
+
+    def persist(self):
+        """Append the samples not saved yet to metrics_YYYY-MM-DD.csv in the persist folder."""
+        if not self.unsaved:
+            return
+        os.makedirs(self.persist_folder, exist_ok=True)
+        path = os.path.join(self.persist_folder, f"metrics_{datetime.now():%Y-%m-%d}.csv")
+        new_file = not os.path.exists(path)
+        with open(path, 'a', newline='') as file:
+            writer = csv.writer(file)
+            if new_file:
+                writer.writerow(FIELDS)
+            writer.writerows([sample[field] for field in FIELDS] for sample in self.unsaved)
+        self.unsaved = []
+
+    def run(self):
+        next_sample = time.monotonic()
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                log_message(f"System metrics sample failed: {e}")
+            # Fixed rate, a slow sample does not shift the ones after it
+            next_sample += self.interval
+            if self.stop_event.wait(max(0, next_sample - time.monotonic())):
+                return
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="system-metrics", daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        """Stop the thread and save what is left."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.persist_folder:
+            self.persist()
+
+_sampler = None
+
+def create_sampler(config):
+    """Return a MetricsSampler for the system_metrics config section."""
+    metrics = config.get('system_metrics', {})
+    persist_folder = os.path.join(PROJECT_DIR, 'logs', 'metrics') if metrics.get('persist', False) else None
+    return MetricsSampler(
+        metrics.get('interval', 10),
+        metrics.get('history', 360),
+        mirror_file=metrics.get('mirror_file', '/dev/shm/timelapse_metrics.json'),
+        persist_folder=persist_folder,
+    )
+
+def start_metrics_sampler(config):
+    """Start sampling in the background if system_metrics is enabled, returns the sampler or None."""
+    global _sampler
+    if not config.get('system_metrics', {}).get('enabled', False):
+        return None
+    _sampler = create_sampler(config).start()
+    return _sampler
+
+def stop_metrics_sampler():
+    global _sampler
+    if _sampler is not None:
+        _sampler.close()
+        _sampler = None
+
+def load_mirror(config):
+    """Return the samples another process mirrored, [] if there are none or they are stale."""
+    metrics = config.get('system_metrics', {})
+    try:
+        with open(metrics.get('mirror_file', '/dev/shm/timelapse_metrics.json'), 'r') as file:
+            mirror = json.load(file)
+    except (OSError, ValueError):
+        return []
+    samples = mirror.get('samples', [])
+    # A sampler that stopped leaves its last samples behind
+    if not samples or time.time() - samples[-1]['time'] > 3 * mirror.get('interval', 10):
+        return []
+    return samples
+
+def get_recent_samples(config, count=1):
+    """
+    Return up to count of the newest samples, oldest first.
+
+    From the sampler of this process if it runs, otherwise from the mirror file of a
+    sampler in another process. Empty if neither has samples.
+    """
+    if _sampler is not None and _sampler.latest() is not None:
+        return list(_sampler.samples)[-count:]
+    return load_mirror(config)[-count:]
+
+def get_latest_sample(config):
+    """Return the newest sample of the running sampler, or None if there is none."""
+    samples = get_recent_samples(config)
+    return samples[-1] if samples else None
+
+if __name__ == "__main__":
+    from .config import load_config, CONFIG_PATH
+
+    parser = argparse.ArgumentParser(description="Sample the system metrics in the background for the capture scripts started by cron.")
+    parser.add_argument("--config", default=CONFIG_PATH, help="Config file.")
+    parser.add_argument("--once", action="store_true", help="Print one sample and exit.")
+    args = parser.parse_args()
+
+    if args.once:
+        sample = take_sample()
+        for field in FIELDS:
+            print(f"{field}: {sample[field]}")
+        print(f"throttling: {', '.join(describe_throttled(sample['throttled'])) or 'none'}")
+    else:
+        sampler = create_sampler(load_config(args.config, sections=('overlay',)))
+        try:
+            sampler.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sampler.close()
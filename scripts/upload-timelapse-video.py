@@ -2,13 +2,13 @@
 import requests
 import argparse
 import os
-import yaml
 import logging
 import datetime
 from colorlog import ColoredFormatter
 import glob
 from PIL import Image
 from daylineImage import create_dayline_image
+from config import load_config
 
 def configure_logger():
     """Configure logger with colored output."""
@@ -61,9 +61,7 @@ def create_thumbnail(image_file, resize=False):
 
 def main(file, date, thumbnail):
     # Load configuration file
-    config_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'config.yaml')
-    with open(config_path, 'r') as config_file:
-        config = yaml.safe_load(config_file)
+    config = load_config(sections=('images', 'upload'))
 
     print(date[:4], date[5:7], date[8:])
     image_output_path = os.path.join(config['image_output']['root_folder'], date[:4], date[5:7], date[8:])
@@ -0,0 +1,27 @@
+#!/usr/bin/python
+import os
+import fcntl
+import struct
+
+# From linux/videodev2.h and linux/v4l2-controls.h
+V4L2_CID_WIDE_DYNAMIC_RANGE = 0x009a0900 + 21
+VIDIOC_G_CTRL = 0xC008561B  # _IOWR('V', 27, struct v4l2_control)
+VIDIOC_S_CTRL = 0xC008561C  # _IOWR('V', 28, struct v4l2_control)
+
+def control_ioctl(device, request, control_id, value=0):
+    """Run a VIDIOC_G_CTRL/VIDIOC_S_CTRL ioctl on a V4L2 device and return the control value."""
+    fd = os.open(device, os.O_RDWR)
+    try:
+        buffer = bytearray(struct.pack('Ii', control_id, value))
+        fcntl.ioctl(fd, request, buffer)
+        return struct.unpack('Ii', buffer)[1]
+    finally:
+        os.close(fd)
+
+def get_control(device, control_id):
+    """Read the current value of a V4L2 control."""
+    return control_ioctl(device, VIDIOC_G_CTRL, control_id)
+
+def set_control(device, control_id, value):
+    """Set a V4L2 control, same as v4l2-ctl --set-ctrl but without starting a process."""
+    return control_ioctl(device, VIDIOC_S_CTRL, control_id, value)
@@ -1,100 +1,259 @@
 #!/usr/bin/python
 
-import time
-import yaml
+import sys
+import signal
 import subprocess
 from datetime import datetime, timedelta
-import json
 import os
+import threading
+from scripts.scheduler import DeadlineScheduler
+from scripts.adaptive_interval import create_adaptive_interval, record_interval
+from scripts.solar import get_sun, get_location
+from scripts.exposure_plan import get_planned_exposure
+from scripts.camera_state import get_camera_state
+from scripts.burst import create_burst_trigger
+from scripts.multi_camera import get_camera_configs
+from scripts.config import load_config, ConfigError, ConfigWatcher, CONFIG_PATH
+from scripts.logger import log_message
+from scripts.staging import start_staging_flusher
+from getWeather import start_weather_refresh
+from scripts.system_metrics import start_metrics_sampler, stop_metrics_sampler
 
-def lerp(x, x_min, x_max, y_min, y_max):
-    return y_min + (x - x_min) / (x_max - x_min) * (y_max - y_min)
+# Seconds a camera thread gets to finish its frame when the timelapse stops
+SHUTDOWN_TIMEOUT = 120
+
+def get_exposure_from_state():
+    """Return the shutter speed and gain last stored in the camera state."""
+    state = get_camera_state().snapshot()
+    return state.get("shutter_speed"), state.get("gain")
+
+def is_within_transition_period(sun, config, now):
+    """Check if now is within the transition period after sunrise or sunset."""
+    constants = config['camera_constants']
+    if sun['sunset'] is not None and sun['sunset'] <= now <= sun['sunset'] + timedelta(minutes=constants['POST_SUNSET_DELAY_MINUTES']):
+        return True
+    return sun['sunrise'] is not None and sun['sunrise'] <= now <= sun['sunrise'] + timedelta(minutes=constants['SUNRISE_OFFSET_MINUTES'])
+
+def is_nighttime(sun, config, now):
+    """Determine if now is considered nighttime, after the sunset transition or before sunrise."""
+    if sun['sunrise'] is None or sun['sunset'] is None:
+        return sun['polar'] == 'night'
+    sunset_end_transition = sun['sunset'] + timedelta(minutes=config['camera_constants']['POST_SUNSET_DELAY_MINUTES'])
+    return sunset_end_transition <= now or now < sun['sunrise']
+
+def get_capture_mode(config, now):
+    """Return 'day', 'transition' or 'night' for the given time."""
+    today = get_sun(config, now.date())
+    if today['polar'] == 'day':
+        # Places where the sun doesn't set
+        return 'day'
+
+    # The sunset transition of yesterday can last past midnight
+    yesterday = get_sun(config, now.date() - timedelta(days=1))
+    if is_within_transition_period(today, config, now) or is_within_transition_period(yesterday, config, now):
+        return 'transition'
+    if is_nighttime(today, config, now):
+        return 'night'
+    return 'day'
+
+def create_frame_queue(config):
+    """Create the frame queue if enabled in config, otherwise return None."""
+    queue_config = config.get('frame_queue', {})
+    if not config.get('persistent_camera', False) or not queue_config.get('enabled', False):
+        return None
+    from scripts.frame_queue import FrameQueue
+    return FrameQueue(queue_config.get('workers', 1), queue_config.get('max_pending', 2))
+
+def start_camera_service(config, frame_queue=None):
+    """Open a persistent camera service if enabled in config, otherwise return None."""
+    if not config.get('persistent_camera', False):
+        return None
+    from capture_image import setup_logging
+    from capture_service import CameraService
+
+    # Everything runs in this process, the state file is only needed for outside readers
+    get_camera_state(config.get('camera_num', 0)).mirror = config.get('camera_state_mirror', True)
+    return CameraService(config, setup_logging(config), frame_queue)
+
+def capture_night_frame(config, camera_service, transition, now=None):
+    """Capture with the exposure planned for this minute using the persistent camera."""
+    shutter_speed, gain, colour_gains = get_planned_exposure(config)
+    return camera_service.capture_night(shutter_speed, gain, transition=transition, colour_gains=colour_gains, now=now)
+
+def capture_frame(config, current_dir, camera_service=None, mode='day'):
+    """
+    Capture a frame for the mode, in-process when a camera service is running, otherwise
+    via capture_image.py or capture_image_night.py.
+
+    :return: Path of the stored frame when known, otherwise None.
+    """
+    if camera_service is None:
+        script = 'capture_image.py' if mode == 'day' else 'capture_image_night.py'
+        subprocess.run(['python3', os.path.join(current_dir, script)])
+        return None
 
-def get_shutter_speed_from_state():
-    """Load the shutter speed from camera_state.json."""
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    camera_state_file = os.path.join(script_dir, 'data', 'camera_state.json')
     try:
-        with open(camera_state_file, "r") as file:
-            state = json.load(file)
-            return state["shutter_speed"]
-    except (FileNotFoundError, KeyError):
+        if mode == 'day':
+            return camera_service.capture_day()
+        return capture_night_frame(config, camera_service, mode == 'transition')
+    except Exception as e:
+        # Release the camera so the next frame starts from a clean configuration
+        print(f"Failed to capture image: {e}")
+        camera_service.close()
         return None
 
-def load_config(config_path):
-    """Load configuration from a YAML file."""
-    with open(config_path, 'r') as config_file:
-        return yaml.safe_load(config_file)
+def capture_burst(camera_service, burst_trigger):
+    """Run a burst if the trigger file exists or the scene activity is high enough."""
+    reason = burst_trigger.check(camera_service.get_exposure()[2])
+    if reason is None:
+        return
+    print(f"Starting burst ({reason})")
+    try:
+        camera_service.capture_burst()
+    except Exception as e:
+        print(f"Burst failed: {e}")
+        camera_service.close()
+
+def get_next_interval(config, adaptive_interval, camera_service, file_name):
+    """Return the interval until the next frame, adapted to exposure and scene activity if enabled."""
+    if adaptive_interval is None:
+        return config['interval']
 
-def load_sun_data():
-    """Load sunrise and sunset data from a JSON file."""
-    current_dir = os.path.dirname(os.path.realpath(__file__))
-    sun_data_file = os.path.join(current_dir, 'data', 'sun_data_2023.json')
-    with open(sun_data_file, 'r') as file:
-        return json.load(file)
-
-def get_sun_times(date, sun_data):
-    """Retrieve sunrise and sunset times for a given date."""
-    date_str = date.strftime('%m-%d')
-    return sun_data.get(date_str, {}).get('sunrise'), sun_data.get(date_str, {}).get('sunset')
-
-def is_within_transition_period(sunrise_time, sunset_time, config):
-    """Check if current time is within the transition period of sunrise or sunset."""
-    sunrise = datetime.strptime(sunrise_time, '%H:%M')
-    sunset = datetime.strptime(sunset_time, '%H:%M')
-    now = datetime.now()
-    return sunset <= now <= sunset + timedelta(minutes=config['camera_constants']['POST_SUNSET_DELAY_MINUTES']) or sunrise <= now <= sunrise + timedelta(minutes=config['camera_constants']['SUNRISE_OFFSET_MINUTES'])
-
-def is_nighttime(sunrise_time, sunset_time, config):
-    """Determine if the current time is considered nighttime."""
-    sunset_end_transition = datetime.strptime(sunset_time, '%H:%M') + timedelta(minutes=config['camera_constants']['POST_SUNSET_DELAY_MINUTES'])
-    sunrise_end_transition = datetime.strptime(sunrise_time, '%H:%M') + timedelta(minutes=config['camera_constants']['SUNRISE_OFFSET_MINUTES'])
-    now = datetime.now().time()
-
-    # Check post-sunset and pre-sunrise-end-transition conditions
-    return sunset_end_transition.time() <= now or now <= sunrise_end_transition.time()
-
-def timelapse(config):
-    """Main function to run the timelapse, deciding which capture script to run based on current time and sun data."""
-    sun_data = load_sun_data()
+    if camera_service is not None:
+        shutter_speed, gain, activity = camera_service.get_exposure()
+    else:
+        shutter_speed, gain = get_exposure_from_state()
+        activity = None
+
+    current_interval = adaptive_interval.next_interval(shutter_speed, gain, activity)
+    camera_num = config.get('camera_num', 0)
+    log_name = 'intervals.csv' if camera_num == 0 else f'intervals_{camera_num}.csv'
+    log_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'logs', log_name)
+    record_interval(log_path, file_name, current_interval, shutter_speed, gain, activity)
+    return current_interval
+
+def check_location(config):
+    """Raise ConfigError if day_night_switching is on and there is no location for the sun times."""
+    if config.get('day_night_switching', False):
+        get_location(config)
+
+def reload_config(watcher, camera_index=None):
+    """
+    Return the edited config if the config file changed and is valid, otherwise None.
+
+    :param camera_index: Return the merged config of this entry of the cameras list.
+    """
+    if watcher is None or not watcher.changed():
+        return None
+    try:
+        config = load_config(watcher.path)
+        if camera_index is not None:
+            config = get_camera_configs(config)[camera_index]
+        check_location(config)
+    except (ConfigError, ValueError, IndexError) as e:
+        log_message(f"Keeping the running config: {e}")
+        return None
+    log_message(f"Reloaded {watcher.path}")
+    return config
+
+def run_camera(config, camera_service=None, watcher=None, camera_index=None, stop_event=None):
+    """
+    Capture frames from one camera until stop_event is set, deciding between day and night settings from the sun position.
+
+    Edits to the config file are picked up before the next frame when a watcher is given.
+    """
     interval = config['interval']
     current_dir = os.path.dirname(os.path.realpath(__file__))
+    schedule = config.get('schedule', {})
+    scheduler = DeadlineScheduler(interval, align_to_clock=schedule.get('align_to_clock', False), late_policy=schedule.get('late_policy', 'skip'))
+    adaptive_interval = create_adaptive_interval(config)
+    # Bursts need the persistent camera
+    burst_trigger = create_burst_trigger(config) if camera_service is not None else None
     
-    while True:
-        today = datetime.now().date()
-        #sunrise_time, sunset_time = get_sun_times(today, sun_data)
-        
-        #if sunrise_time == "never_sets" or sunset_time == "never_sets":
-        #    # Places where the sun doesn't set or rise
-        #    subprocess.run(['python3', os.path.join(current_dir, 'capture_image.py')])
-        #elif is_within_transition_period(sunrise_time, sunset_time, config):
-        #    # Transition periods (around sunrise and sunset)
-        #    subprocess.run(['python3', os.path.join(current_dir, 'capture_image_night.py')])
-        #elif is_nighttime(sunrise_time, sunset_time, config):
-        #    # Nighttime
-        #    subprocess.run(['python3', os.path.join(current_dir, 'capture_image_night.py')])
-        #else:
-            # Daytime
-        subprocess.run(['python3', os.path.join(current_dir, 'capture_image.py')])
-
-        shutter_speed = get_shutter_speed_from_state()
-
-        if shutter_speed:
-            DAYTIME_SHUTTER = config['camera_constants']['DAYTIME_SHUTTER']
-            MAX_SHUTTER = config['camera_constants']['MAX_SHUTTER']
-            SLEEP_INTERVAL_MIN = interval 
-            SLEEP_INTERVAL_MAX = 0
-            #current_interval = lerp(shutter_speed, DAYTIME_SHUTTER, MAX_SHUTTER, SLEEP_INTERVAL_MIN, SLEEP_INTERVAL_MAX)
-            current_interval = interval
-            time.sleep(current_interval)
-        else:
-            current_interval = config['interval']
-            time.sleep(config['interval'])
-
-        print(f"Current interval {current_interval}")
+    while stop_event is None or not stop_event.is_set():
+        scheduler.wait()
+        if stop_event is not None and stop_event.is_set():
+            break
+
+        new_config = reload_config(watcher, camera_index)
+        if new_config is not None:
+            config = new_config
+            scheduler.late_policy = config.get('schedule', {}).get('late_policy', 'skip')
+            adaptive_interval = create_adaptive_interval(config)
+            burst_trigger = create_burst_trigger(config) if camera_service is not None else None
+            if camera_service is not None:
+                camera_service.update_config(config)
+
+        # Without day_night_switching the day settings are used around the clock
+        mode = get_capture_mode(config, datetime.now()) if config.get('day_night_switching', False) else 'day'
+        file_name = capture_frame(config, current_dir, camera_service, mode)
+        if burst_trigger is not None:
+            capture_burst(camera_service, burst_trigger)
+
+        current_interval = get_next_interval(config, adaptive_interval, camera_service, file_name)
+        scheduler.set_interval(current_interval)
+
+        print(f"Current interval {current_interval:.1f}")
+
+def create_watcher(config, config_path):
+    """Watch the config file for edits unless hot_reload is disabled."""
+    return ConfigWatcher(config_path) if config.get('hot_reload', True) else None
+
+def timelapse(config, config_path=CONFIG_PATH):
+    """
+    Main function to run the timelapse.
+
+    With a cameras list and the persistent camera, each camera runs its own schedule on its
+    own thread and they share one frame queue. Cameras with the same interval and
+    schedule.align_to_clock capture on the same deadlines.
+    """
+    check_location(config)
+    frame_queue = create_frame_queue(config)
+    camera_services = []
+    threads = []
+    stop_event = threading.Event()
+    # Without the persistent camera the capture scripts flush the staging area themselves
+    staging_flusher = start_staging_flusher(config) if config.get('persistent_camera', False) else None
+    # The capture scripts refresh the weather data on demand, the long-running process keeps it fresh
+    weather_provider = start_weather_refresh(config) if config.get('persistent_camera', False) and config['overlay']['enabled'] else None
+    start_metrics_sampler(config)
+    try:
+        if not config.get('cameras'):
+            camera_services.append(start_camera_service(config, frame_queue))
+            run_camera(config, camera_services[0], create_watcher(config, config_path))
+            return
+        if not config.get('persistent_camera', False):
+            raise ValueError("Multiple cameras need persistent_camera: True")
 
+        for index, camera_config in enumerate(get_camera_configs(config)):
+            check_location(camera_config)
+            camera_service = start_camera_service(camera_config, frame_queue)
+            camera_services.append(camera_service)
+            args = (camera_config, camera_service, create_watcher(config, config_path), index, stop_event)
+            thread = threading.Thread(target=run_camera, args=args, name=f"camera-{camera_config['camera_num']}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    finally:
+        # Let the camera threads finish the frame they are on, they are daemons in case one hangs
+        stop_event.set()
+        for thread in threads:
+            thread.join(SHUTDOWN_TIMEOUT)
+        for camera_service in camera_services:
+            if camera_service is not None:
+                camera_service.close()
+        # Write the frames still in the queue before the staging area is flushed for the last time
+        if frame_queue is not None:
+            frame_queue.close()
+        if weather_provider is not None:
+            weather_provider.stop()
+        stop_metrics_sampler()
+        if staging_flusher is not None:
+            staging_flusher.close()
 
 if __name__ == "__main__":
-    config_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'config.yaml')
-    config = load_config(config_path)
-    timelapse(config)
+    # Stop the same way on SIGTERM from systemd or kill as on Ctrl-C, so queued frames are written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    config = load_config(CONFIG_PATH)
+    timelapse(config, CONFIG_PATH)
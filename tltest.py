@@ -1,56 +1,41 @@
 #!/usr/bin/python
 import time
-import yaml
 import subprocess
 from datetime import datetime, timedelta
-import json
-import os
+from scripts.solar import get_sun
+from scripts.config import load_config
 
 SUNRISE_OFFSET_MINUTES = -60  # Start transition 1 hour before actual sunrise
 
-def load_config(config_path):
-    with open(config_path, 'r') as config_file:
-        return yaml.safe_load(config_file)
-
-def load_sun_data():
-    current_dir = os.path.dirname(os.path.realpath(__file__))
-    sun_data_file = os.path.join(current_dir, 'data', 'sun_data_2023.json')
-    with open(sun_data_file, 'r') as file:
-        return json.load(file)
-
-def get_sun_times(date, sun_data):
-    date_str = date.strftime('%m-%d')
-    return sun_data.get(date_str, {}).get('sunrise'), sun_data.get(date_str, {}).get('sunset')
-
-def is_within_transition_period(sunrise_time, sunset_time):
-    sunrise = datetime.strptime(sunrise_time, '%H:%M') + timedelta(minutes=SUNRISE_OFFSET_MINUTES)
-    sunset = datetime.strptime(sunset_time, '%H:%M')
+def is_within_transition_period(sun):
     now = datetime.now()
+    if sun['sunrise'] is None or sun['sunset'] is None:
+        return False
+    sunrise = sun['sunrise'] + timedelta(minutes=SUNRISE_OFFSET_MINUTES)
     print(f"now {now}")
-    return sunset <= now <= sunset + timedelta(hours=2) or sunrise <= now <= datetime.strptime(sunrise_time, '%H:%M')
+    return sun['sunset'] <= now <= sun['sunset'] + timedelta(hours=2) or sunrise <= now <= sun['sunrise']
 
 def timelapse(config):
-    sun_data = load_sun_data()
     interval = config['interval']
-    current_dir = os.path.dirname(os.path.realpath(__file__))
     
     while True:
         today = datetime.now().date()
-        sunrise_time, sunset_time = get_sun_times(today, sun_data)
+        sun = get_sun(config, today)
+        sunrise_time, sunset_time = sun['sunrise'], sun['sunset']
         
-        # If there's "never_sets", just run the daytime script
-        if sunrise_time == "never_sets" or sunset_time == "never_sets":
+        # If the sun never sets, just run the daytime script
+        if sun['polar'] == 'day':
             print("Running daytime script")
         # If it's nighttime or within the transition period, run the nighttime script
-        elif is_within_transition_period(sunrise_time, sunset_time):
+        elif is_within_transition_period(sun):
         # Otherwise, run the daytime script
-            print(f"Running nighttime script {is_within_transition_period(sunrise_time,sunset_time)} {sunset_time} {sunrise_time}")
+            print(f"Running nighttime script {is_within_transition_period(sun)} {sunset_time} {sunrise_time}")
         else:
-            print(f"Running nighttime script {is_within_transition_period(sunrise_time,sunset_time)} {sunset_time} {sunrise_time}")
+            print(f"Running nighttime script {is_within_transition_period(sun)} {sunset_time} {sunrise_time}")
             print("Running daytime script")
         
         time.sleep(interval)
 
 if __name__ == "__main__":
-    config = load_config(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'config.yaml'))
+    config = load_config(sections=('camera', 'location'))
     timelapse(config)
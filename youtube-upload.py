@@ -2,12 +2,12 @@
 import os
 import google_auth_oauthlib.flow
 import googleapiclient.discovery
-import yaml
 import googleapiclient.errors
 import logging
 import socket
 from google.auth import exceptions
 from google.oauth2 import service_account
+from scripts.config import load_config
 
 # Set up logging
 def setup_logging(config):
@@ -20,12 +20,6 @@ def setup_logging(config):
     else:
         return False
 
-# Load configuration from yaml file
-def load_config():
-    config_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'config.yaml')
-    with open(config_path, 'r') as config_file:
-        return yaml.safe_load(config_file)
-
 def upload_video(filename, title, description, category_id, privacy_status, playlist_id, logging_enabled):
     try:
         SCOPES = ['https://www.googleapis.com/auth/youtube.upload']
@@ -105,6 +99,6 @@ if __name__ == "__main__":
     category_id = "22"  # replace as per your requirements
     privacy_status = "public"  # or "public" or "unlisted"
     playlist_id = "PLl4QUohU2aB5oa0VycZb6H3hLPefErPK2"  # replace with your playlist ID
-    config = load_config()
+    config = load_config(sections=())
     logging_enabled = setup_logging(config)
     upload_video(filename, title, description, category_id, privacy_status, playlist_id, logging_enabled)